@@ -0,0 +1,15 @@
+"""
+Helpers shared by the benchmarks
+"""
+
+import timeit
+
+_UNITS = {"ns": 1e9, "us": 1e6, "ms": 1e3}
+
+
+def bench(label: str, stmt, number: int, unit: str = "us") -> None:
+    """
+    Time `stmt` and print the best time per call in `unit` (ns, us or ms)
+    """
+    best = min(timeit.repeat(stmt, number=number, repeat=5)) / number
+    print(f"{label:<40} {best * _UNITS[unit]:10.1f} {unit}/call")
@@ -0,0 +1,115 @@
+"""
+Benchmarks for the asyncio module
+
+Run with: PYTHONPATH=. python benchmarks/bench_asyncio.py
+"""
+import asyncio
+from _bench import bench
+from frittomisto.asyncio import (
+    make_sync,
+    bounded_map,
+    async_cached,
+    offload,
+    pool_map,
+    warm_up_pool,
+)
+
+
+async def trivial() -> int:
+    """
+    A coroutine which does nothing
+    """
+    return 1
+
+
+async def trivial_arg(_: int) -> int:
+    """
+    A coroutine which does nothing
+    """
+    return 1
+
+
+async def identity(x: int) -> int:
+    """
+    A coroutine which returns its argument
+    """
+    await asyncio.sleep(0)
+    return x
+
+
+@async_cached(maxsize=None)
+async def cached_identity(x: int) -> int:
+    """
+    A cached coroutine which returns its argument
+    """
+    return x
+
+
+async def call_many(func, n: int) -> None:
+    """
+    Await func(0) `n` times
+    """
+    for _ in range(n):
+        await func(0)
+
+
+async def gather_all(n: int) -> None:
+    """
+    Run `n` coroutines at once with gather
+    """
+    await asyncio.gather(*(identity(i) for i in range(n)))
+
+
+async def map_all(n: int, ordered: bool) -> None:
+    """
+    Run `n` coroutines with bounded_map
+    """
+    async for _ in bounded_map(identity, range(n), concurrency=100, ordered=ordered):
+        pass
+
+
+def double(x: int) -> int:
+    """
+    Trivial function to measure the cost of offloading
+    """
+    return 2 * x
+
+
+offloaded_double = offload(double)
+
+
+async def offload_all(n: int) -> None:
+    """
+    Offload `n` calls one by one to the process pool
+    """
+    await asyncio.gather(*(offloaded_double(i) for i in range(n)))
+
+
+def main() -> None:
+    """
+    Measure the per-call overhead of make_sync on a trivial coroutine,
+    of async_cached hits, and the per-item overhead of bounded_map,
+    offload and pool_map
+    """
+    bench("make_sync, new loop per call", make_sync(trivial), 200)
+    bench("make_sync, persistent loop", make_sync(persistent=True)(trivial), 2_000)
+
+    n = 10_000
+    bench("10k calls, not cached", lambda: asyncio.run(call_many(trivial_arg, n)), 1)
+    bench("10k calls, async_cached hits", lambda: asyncio.run(call_many(cached_identity, n)), 1)
+    bench("10k items, gather", lambda: asyncio.run(gather_all(n)) or n, 1)
+    for ordered in (True, False):
+        bench(
+            f"10k items, bounded_map ordered={ordered}",
+            lambda o=ordered: asyncio.run(map_all(n, o)),
+            1,
+        )
+
+    warm_up_pool()
+    n = 1_000
+    bench("1k items, offload each", lambda: asyncio.run(offload_all(n)), 1)
+    bench("1k items, pool_map", lambda: asyncio.run(pool_map(double, range(n))), 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmarks for the cfg module
+
+Run with: PYTHONPATH=. python benchmarks/bench_cfg.py
+"""
+import os
+import tempfile
+from functools import partial
+from _bench import bench
+from frittomisto.cfg import FrittoMistoCfg
+
+
+def write_config(path: str, sections: int) -> None:
+    """
+    Write a config file with `sections` tables of a few values each
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(sections):
+            f.write(f'[section_{i}]\nname = "service {i}"\nport = {8000 + i}\n')
+            f.write(f"ratio = {i / 7}\nenabled = true\ntags = [\"a\", \"b\", \"c\"]\n\n")
+
+
+def main() -> None:
+    """
+    Compare the startup time of a config parsed from scratch and loaded from the cache,
+    and the time of nested and dotted lookups
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "frittomisto.toml")
+        cache_dir = os.path.join(tmpdir, "cache")
+        for sections in (10, 1000):
+            write_config(path, sections)
+
+            def _load(cache_dir=None):
+                config = FrittoMistoCfg()
+                config.set_config_file(path)
+                config.set_cache_dir(cache_dir)
+                config.get("section_0")
+
+            print(f"{sections} sections, {os.path.getsize(path)} bytes")
+            bench("cold parse", _load, 10, unit="ms")
+            _load(cache_dir)
+            bench("cache hit", partial(_load, cache_dir), 10)
+
+        config = FrittoMistoCfg()
+        config.set_config_file(path)
+        config.get("section_0")
+        bench("lookup cfg['section_9']['port']", lambda: config["section_9"]["port"], 100_000, "ns")
+        bench(
+            "lookup cfg.get('section_9.port')", lambda: config.get("section_9.port"), 100_000, "ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Import-time benchmark of the frittomisto modules, fails when a module exceeds its budget
+
+Run with: PYTHONPATH=. python benchmarks/bench_import.py
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from typing import Dict
+
+# Budget of the cumulative import time of each module, in milliseconds, including
+# the standard modules it imports which are not imported at startup (e.g. typing)
+BUDGETS_MS = {
+    "frittomisto": 3,
+    "frittomisto.asyncio": 100,
+    "frittomisto.cfg": 35,
+    "frittomisto.io": 10,
+    "frittomisto.json": 50,
+    "frittomisto.logging": 40,
+    "frittomisto.path": 30,
+    "frittomisto.profiling": 40,
+    "frittomisto.time": 25,
+    "frittomisto.url": 30,
+}
+
+_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)")
+
+
+def import_time(module: str, pycache: str, repeat: int = 5) -> float:
+    """
+    Return the best cumulative import time of `module` in a fresh interpreter, in milliseconds.
+    Bytecode is cached in `pycache`, so that compiling the sources is not measured.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(repeat + 1):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-X", f"pycache_prefix={pycache}",
+             "-c", f"import {module}"],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr
+        cumulative: Dict[str, int] = {
+            name: int(us) for us, name in _IMPORTTIME.findall(stderr)
+        }
+        times.append(cumulative[module] / 1000)
+    # The first run writes the bytecode cache
+    return min(times[1:])
+
+
+def main() -> int:
+    """
+    Measure the import time of each module, return 1 if a module exceeds its budget
+    """
+    over_budget = []
+    with tempfile.TemporaryDirectory() as pycache:
+        for module, budget in BUDGETS_MS.items():
+            elapsed = import_time(module, pycache)
+            status = "ok" if elapsed <= budget else "OVER BUDGET"
+            print(f"{module:<25} {elapsed:8.2f} ms (budget {budget:3} ms) {status}")
+            if elapsed > budget:
+                over_budget.append(module)
+    if over_budget:
+        print(f"Modules over budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Benchmarks for the json module
+
+Run with: PYTHONPATH=. python benchmarks/bench_json.py
+"""
+import io
+import json
+import tempfile
+import tracemalloc
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union, get_args, get_origin, get_type_hints
+from _bench import bench
+from frittomisto.json import JSONSerializable, set_json_parser, write_json_lines
+
+
+@dataclass
+class Leaf(JSONSerializable):
+    """
+    Innermost record
+    """
+    name: str
+    score: float
+    tags: List[str]
+
+
+@dataclass
+class Branch(JSONSerializable):
+    """
+    Record with nested records
+    """
+    id: int
+    leaves: List[Leaf]
+    by_name: Dict[str, Leaf]
+    parent: Optional[Leaf] = None
+
+
+@dataclass
+class Root(JSONSerializable):
+    """
+    Top level record
+    """
+    branches: List[Branch]
+    meta: Dict[str, str]
+
+
+@dataclass
+class Click(JSONSerializable):
+    """
+    Untagged event
+    """
+    x: int
+    y: int
+
+
+@dataclass
+class Scroll(JSONSerializable):
+    """
+    Untagged event
+    """
+    dy: int
+
+
+@dataclass
+class Key(JSONSerializable):
+    """
+    Untagged event
+    """
+    key: str
+
+
+@dataclass
+class Events(JSONSerializable):
+    """
+    Union of untagged events, decoded by trial
+    """
+    events: List[Union[Click, Scroll, Key]]
+
+
+@dataclass
+class TaggedClick(JSONSerializable, json_tag="click"):
+    """
+    Tagged event
+    """
+    x: int
+    y: int
+
+
+@dataclass
+class TaggedScroll(JSONSerializable, json_tag="scroll"):
+    """
+    Tagged event
+    """
+    dy: int
+
+
+@dataclass
+class TaggedKey(JSONSerializable, json_tag="key"):
+    """
+    Tagged event
+    """
+    key: str
+
+
+@dataclass
+class TaggedEvents(JSONSerializable):
+    """
+    Union of tagged events, decoded by dispatch on the tag
+    """
+    events: List[Union[TaggedClick, TaggedScroll, TaggedKey]]
+
+
+def make_doc(n_branches: int = 10, n_leaves: int = 10) -> Dict[str, Any]:
+    """
+    Build a nested document to decode
+    """
+    leaf = {"name": "leaf", "score": 1.5, "tags": ["a", "b"]}
+    branch = {
+        "id": 1,
+        "leaves": [leaf] * n_leaves,
+        "by_name": {str(i): leaf for i in range(n_leaves)},
+        "parent": leaf,
+    }
+    return {"branches": [branch] * n_branches, "meta": {"k": "v"}}
+
+
+def legacy_from_dict(cls: Any, d: Dict[str, Any]) -> Any:
+    """
+    Reference copy of the reflection based from_dict, used as baseline
+    """
+
+    def _fit_to_type(cc: Any, v: Any) -> Any:
+        cc_orig = get_origin(cc) or cc
+        if cc is None or cc_orig in {str, int, float, bool, Any}:
+            return v
+        if cc_orig in {list, set}:
+            return [_fit_to_type(get_args(cc)[0], x) for x in v]
+        if cc_orig == tuple:
+            return tuple(_fit_to_type(c, x) for c, x in zip(get_args(cc), v))
+        if cc_orig == dict:
+            key_class, value_class = get_args(cc)
+            return {
+                _fit_to_type(key_class, kk): _fit_to_type(value_class, vv)
+                for kk, vv in v.items()
+            }
+        if cc_orig == Union:
+            for cc_child in get_args(cc):
+                try:
+                    return _fit_to_type(cc_child, v)
+                except Exception:  # pylint: disable=broad-except
+                    pass
+        if issubclass(cc_orig, JSONSerializable):
+            return legacy_from_dict(cc, v)
+        raise RuntimeError(f"Unknown type {cc}")
+
+    kwargs = {}
+    for k, v in d.items():
+        kwargs[k] = _fit_to_type(get_type_hints(cls).get(k, None), v)
+    return cls(**kwargs)
+
+
+def legacy_to_dict(obj: Any) -> Dict[str, Any]:
+    """
+    Reference copy of the reflection based to_dict, used as baseline
+    """
+    ret: Dict[str, Any] = {}
+    for k, v in obj.__dict__.items():
+        if isinstance(v, JSONSerializable):
+            ret[k] = legacy_to_dict(v)
+        elif isinstance(v, (list, set, tuple)):
+            ret[k] = [legacy_to_dict(x) if isinstance(x, JSONSerializable) else x for x in v]
+        elif isinstance(v, dict):
+            ret[k] = {
+                kk: legacy_to_dict(vv) if isinstance(vv, JSONSerializable) else vv
+                for kk, vv in v.items()
+            }
+        else:
+            ret[k] = v
+    return ret
+
+
+def bench_streaming(n_records: int) -> None:
+    """
+    Print the peak memory used to stream `n_records` records through a file
+    """
+    leaf = Leaf("leaf", 1.5, ["a", "b"])
+    ndjson, array = io.BytesIO(), io.BytesIO()
+    write_json_lines((leaf for _ in range(n_records)), ndjson)
+    array.write(b"[" + b",".join(leaf.to_json().encode() for _ in range(n_records)) + b"]")
+
+    for label, fp, reader in [
+        ("ndjson", ndjson, Leaf.iter_from_json_lines),
+        ("array", array, Leaf.iter_from_json_array),
+    ]:
+        fp.seek(0)
+        tracemalloc.start()
+        count = sum(1 for _ in reader(fp))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert count == n_records
+        print(f"stream {label:<7} {n_records:>8} records {peak / 1024:10.1f} KiB peak")
+
+
+@dataclass
+class Point(JSONSerializable):
+    """
+    Small record
+    """
+    x: int
+    y: float
+    label: str
+
+
+def bench_records(n_records: int) -> None:
+    """
+    Print memory per record and decoding time of small records
+    """
+    ds = [{"x": i, "y": i / 3, "label": "p"} for i in range(n_records)]
+    slotted_point = Point.slotted()
+
+    for label, decode in [
+        ("list of objects", lambda: [Point.from_dict(d) for d in ds]),
+        ("list of slotted objects", lambda: [slotted_point.from_dict(d) for d in ds]),
+        ("columnar batch", lambda: Point.from_dicts(ds)),
+    ]:
+        tracemalloc.start()
+        decoded = decode()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del decoded
+        print(f"{label:<40} {size / n_records:10.1f} bytes/record")
+        bench(f"decode {n_records} records, {label}", decode, 1)
+
+
+def bench_sources(parser: str) -> None:
+    """
+    Print time and peak memory of from_json for different sources of a large document
+    """
+    set_json_parser(parser)
+    doc = {"branches": make_doc(10, 10)["branches"] * 100, "meta": {}}
+    data = json.dumps(doc).encode("utf-8")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "doc.json"
+        path.write_bytes(data)
+        for label, src in [
+            ("str", lambda: data.decode("utf-8")),
+            ("bytes", lambda: data),
+            ("memoryview", lambda: memoryview(data)),
+            ("path (mmap)", lambda: path),
+        ]:
+            tracemalloc.start()
+            Root.from_json(src(), lazy=True)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"from_json {parser} {label:<20} {peak / 1024:10.1f} KiB peak")
+            bench(f"from_json {parser} {label}", lambda s=src: Root.from_json(s(), lazy=True), 5)
+    set_json_parser()
+
+
+def main() -> None:
+    """
+    Compare the reflection based decoding with the compiled decoders
+    """
+    doc = make_doc()
+    assert legacy_from_dict(Root, doc) == Root.from_dict(doc)
+    bench("from_dict, reflection (before)", lambda: legacy_from_dict(Root, doc), 20)
+    bench("from_dict, compiled decoders (after)", lambda: Root.from_dict(doc), 200)
+
+    root = Root.from_dict(doc)
+    assert legacy_to_dict(root) == root.to_dict()
+    assert json.dumps(legacy_to_dict(root)) == root.to_json()
+    bench("to_dict, reflection (before)", lambda: legacy_to_dict(root), 200)
+    bench("to_dict, compiled encoders (after)", root.to_dict, 200)
+    bench("to_json, via to_dict (before)", lambda: json.dumps(legacy_to_dict(root)), 200)
+    bench("to_json, direct encoding (after)", root.to_json, 200)
+
+    bench("from_dict + read one field, eager", lambda: Root.from_dict(doc).meta, 200)
+    bench("from_dict + read one field, lazy", lambda: Root.from_dict(doc, lazy=True).meta, 200)
+
+    events = {"events": [{"key": "a"}] * 1000}
+    tagged_events = {"events": [{"type": "key", "key": "a"}] * 1000}
+    bench("Union decoding, trial order", lambda: Events.from_dict(events), 20)
+    bench("Union decoding, tagged dispatch", lambda: TaggedEvents.from_dict(tagged_events), 20)
+
+    for n_records in (10_000, 100_000):
+        bench_streaming(n_records)
+
+    bench_records(100_000)
+
+    for parser in ("json", "orjson"):
+        try:
+            bench_sources(parser)
+        except ImportError:
+            print(f"{parser} is not installed")
+
+
+if __name__ == "__main__":
+    main()
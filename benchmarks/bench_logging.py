@@ -0,0 +1,77 @@
+"""
+Benchmarks for the logging module
+
+Run with: PYTHONPATH=. python benchmarks/bench_logging.py
+"""
+import logging
+import os
+import time
+from typing import List
+from frittomisto.logging import get_logger, SamplingFilter
+
+
+class SlowStream:
+    """
+    Stream taking `delay` seconds for each write, like a slow consumer of stderr
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.devnull = open(os.devnull, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def write(self, text: str) -> int:
+        """
+        Write text to /dev/null, slowly
+        """
+        time.sleep(self.delay)
+        return self.devnull.write(text)
+
+    def flush(self) -> None:
+        """
+        Flush the stream
+        """
+        self.devnull.flush()
+
+
+def bench(label: str, logger: logging.Logger, number: int) -> None:
+    """
+    Log `number` messages and print the throughput and latency of the logging calls
+    """
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for i in range(number):
+        call_start = time.perf_counter()
+        logger.error("message %d with %s", i, "argument")
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    logger.handlers[-1].flush()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(
+        f"{label:<30} {number / elapsed:10.0f} calls/s"
+        f" mean {elapsed / number * 1e6:8.1f} us"
+        f" p99 {p99 * 1e6:8.1f} us max {latencies[-1] * 1e6:8.1f} us"
+    )
+
+
+def main() -> None:
+    """
+    Compare logging with a StreamHandler and with a BackgroundStreamHandler,
+    to /dev/null and to a stream taking 100 us per write, and the cost of
+    JSON formatting and of sampling records
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        for background in (False, True):
+            name = f"/dev/null, {'background' if background else 'stream'}"
+            bench(name, get_logger(name, stream=devnull, background=background), 50_000)
+        bench("/dev/null, JSON", get_logger("json", stream=devnull, structured=True), 50_000)
+        logger = get_logger("sampled", stream=devnull, structured=True)
+        logger.addFilter(SamplingFilter(every=100))
+        bench("/dev/null, JSON, 1 in 100", logger, 50_000)
+    for background in (False, True):
+        name = f"slow stream, {'background' if background else 'stream'}"
+        bench(name, get_logger(name, stream=SlowStream(1e-4), background=background), 5_000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmarks for the profiling module
+
+Run with: PYTHONPATH=. python benchmarks/bench_profiling.py
+"""
+from _bench import bench
+from frittomisto.profiling import (
+    pp_start,
+    pp_stop,
+    pp_reset,
+    pp_profile,
+    pp_section,
+    pp_trace,
+    pp_tree,
+    pp_sample_start,
+    pp_sample_stop,
+    pp_untrack_memory,
+    _Histogram,
+)
+
+
+def main() -> None:
+    """
+    Measure the overhead of recording measures and of instrumenting a call
+    """
+    hist = _Histogram()
+    bench("histogram record", lambda: hist.record(1.234e-4), 100_000, unit="ns")
+
+    def func() -> None:
+        pass
+
+    def _start_stop():
+        pp_start("bench")
+        func()
+        pp_stop("bench")
+
+    section = pp_section("bench section")
+
+    def _section():
+        with section:
+            func()
+
+    sampled_section = pp_section("bench sampled section", sample_rate=100)
+
+    def _sampled_section():
+        with sampled_section:
+            func()
+
+    bench("call, not instrumented", func, 100_000, unit="ns")
+    bench("call, pp_start + pp_stop", _start_stop, 100_000, unit="ns")
+    bench("call, pp_section", _section, 100_000, unit="ns")
+    pp_tree()
+    bench("call, pp_section in call tree", _section, 100_000, unit="ns")
+    pp_tree(False)
+    bench("call, pp_section 1/100 sampled", _sampled_section, 100_000, unit="ns")
+    bench("call, pp_profile", pp_profile("bench profile")(func), 100_000, unit="ns")
+    bench(
+        "call, pp_profile 1/100 sampled",
+        pp_profile("bench sampled profile", sample_rate=100)(func),
+        100_000,
+        unit="ns",
+    )
+    pp_trace(1 << 16)
+    bench("call, pp_section traced", _section, 100_000, unit="ns")
+    pp_trace(None)
+    memory_section = pp_section("bench memory section", memory=True)
+
+    def _memory_section():
+        with memory_section:
+            func()
+
+    bench("call, pp_section with memory", _memory_section, 100_000, unit="ns")
+    pp_untrack_memory()
+    pp_reset()
+
+    def _work():
+        return sum(i * i for i in range(1000))
+
+    bench("work, not sampled", _work, 10_000, unit="ns")
+    for interval in (0.01, 0.001):
+        pp_sample_start(interval)
+        bench(f"work, sampled every {interval * 1000:g} ms", _work, 10_000, unit="ns")
+        pp_sample_stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+A fried mix of python utilities.
+
+Submodules are imported on first access, e.g. `frittomisto.cfg`, so that
+importing frittomisto only pays for the utilities which are used.
+"""
+from __future__ import annotations
+
+import importlib
+from types import ModuleType
+
+# Like typing.TYPE_CHECKING without importing typing, which type checkers consider True
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    # Visible to type checkers only, at runtime see __getattr__
+    from . import asyncio, cfg, io, json, logging, path, profiling, time, url
+
+__all__ = ["asyncio", "cfg", "io", "json", "logging", "path", "profiling", "time", "url"]
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in __all__:
+        # importlib stores the module in the package, next accesses don't come here
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -2,11 +2,135 @@
 Utilities for async functions
 """
 import asyncio
-from typing import Callable, Any, Coroutine, List, Dict
-from functools import wraps
+import atexit
+import inspect
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from typing import (
+    Callable, Any, Awaitable, List, Dict, Iterator, Optional, AsyncIterable,
+    AsyncIterator, Iterable, Set, TypeVar, Union, Deque, Generic, Hashable, NamedTuple, Tuple,
+)
+from functools import partial, wraps
 
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+_F = TypeVar("_F", bound=Callable[..., Any])
 
-def make_sync(func: Callable[...,Coroutine[Any, Any, Any]]) -> Callable[...,Any]:
+
+class _BackgroundLoop:
+    """
+    Event loop running forever in a daemon thread, see background_loop
+    """
+
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    thread: Optional[threading.Thread] = None
+    lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop which runs the functions decorated with
+    make_sync(persistent=True), starting it in a daemon thread if needed.
+    Resources bound to a loop (e.g. connection pools) can be created in it
+    and reused across calls.
+    """
+    loop = _BackgroundLoop.loop
+    if loop is not None:
+        return loop
+    with _BackgroundLoop.lock:
+        if _BackgroundLoop.loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name="frittomisto-loop", daemon=True
+            )
+            thread.start()
+            _BackgroundLoop.loop, _BackgroundLoop.thread = loop, thread
+        return _BackgroundLoop.loop
+
+
+@atexit.register
+def _stop_background_loop() -> None:
+    loop, thread = _BackgroundLoop.loop, _BackgroundLoop.thread
+    if loop is None or thread is None:
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    _BackgroundLoop.loop = _BackgroundLoop.thread = None
+
+
+def _forget_background_loop() -> None:
+    # The thread running the loop does not exist in a forked child
+    _BackgroundLoop.loop = _BackgroundLoop.thread = None
+    _BackgroundLoop.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_background_loop)
+
+
+async def _await(awaitable: Awaitable[_T]) -> _T:
+    return await awaitable
+
+
+def _run_in_background(awaitable: Awaitable[Any]) -> Any:
+    """
+    Run `awaitable` (e.g. a coroutine) in the background loop and wait for its result
+    """
+    loop = background_loop()
+    # run_coroutine_threadsafe only accepts coroutines
+    coro = awaitable if asyncio.iscoroutine(awaitable) else _await(awaitable)
+    if threading.current_thread() is _BackgroundLoop.thread:
+        coro.close()
+        raise RuntimeError(
+            "Cannot wait for a persistent make_sync function from the background loop "
+            "itself, it would deadlock: await the async function instead"
+        )
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _iterate_in_background(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Iterate over `agen` in the background loop
+    """
+    try:
+        while True:
+            try:
+                yield _run_in_background(agen.__anext__())  # pylint: disable=unnecessary-dunder-call
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None and _BackgroundLoop.loop is not None:
+            _run_in_background(aclose())
+
+
+def _iterate_in_new_loop(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Iterate over `agen` in a new event loop, closed at the end of the iteration
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())  # pylint: disable=unnecessary-dunder-call
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(agen, "aclose", None)
+        if aclose is not None:
+            loop.run_until_complete(aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def make_sync(
+    func: Optional[Callable[..., Any]] = None, *, persistent: bool = False
+) -> Any:
     """
     Decorator to run async functions synchronously
     Usage:
@@ -15,10 +139,615 @@ def make_sync(func: Callable[...,Coroutine[Any, Any, Any]]) -> Callable[...,Any]
     async def foo():
         pass
 
+    By default each call runs in a new event loop (with asyncio.run).
+    If persistent is True, calls run in a long-lived event loop in a background
+    thread (see background_loop), which is much faster for short calls, allows
+    reusing loop-bound resources across calls and can be used from sync code
+    called by another event loop (blocking it while waiting):
+
+    @make_sync(persistent=True)
+    async def bar():
+        pass
+
+    Async generator functions become generator functions.
     """
+    if func is None:
+        return partial(make_sync, persistent=persistent)
+
+    if inspect.isasyncgenfunction(func):
+        iterate = _iterate_in_background if persistent else _iterate_in_new_loop
+
+        @wraps(func)
+        def gen_wrapper(*args: List[Any], **kwargs: Dict[Any, Any]) -> Iterator[Any]:
+            return iterate(func(*args, **kwargs))
+
+        return gen_wrapper
+
+    run = _run_in_background if persistent else asyncio.run
 
     @wraps(func)
     def wrapper(*args: List[Any], **kwargs: Dict[Any, Any]) -> Any:
-        return asyncio.run(func(*args, **kwargs))
+        return run(func(*args, **kwargs))
 
     return wrapper
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, for the tasks of one event loop:
+    tokens are added at `rate` per second, up to `capacity` (the maximum burst),
+    and each operation takes some tokens, waiting for them if needed.
+    Usage:
+
+    bucket = TokenBucket(rate=100) # 100 operations per second
+    await bucket.acquire()
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1.0, rate) if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Take `tokens` tokens if they are available, return whether they were taken
+        """
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Take `tokens` tokens, waiting until they are available
+        """
+        if tokens > self.capacity:
+            raise ValueError("Cannot acquire more tokens than the capacity of the bucket")
+        while not self.try_acquire(tokens):
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+async def _aiter(items: Union[Iterable[_T], AsyncIterable[_T]]) -> AsyncIterator[_T]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class _BoundedMap(Generic[_T, _R]):  # pylint: disable=too-many-instance-attributes
+    """
+    State of a bounded_map generator
+    """
+
+    def __init__(
+        self,
+        func: Callable[[_T], Awaitable[_R]],
+        items: Union[Iterable[_T], AsyncIterable[_T]],
+        concurrency: int,
+        ordered: bool,
+        rate_limiter: Optional[TokenBucket],
+    ):
+        self.func = func
+        self.source = _aiter(items)
+        self.ordered = ordered
+        self.rate_limiter = rate_limiter
+        # A slot is taken before pulling an item, and given back when its result is yielded
+        self.slots = asyncio.Semaphore(concurrency)
+        # Running or finished calls not yielded yet, and the same in the order of the items
+        self.tasks: Set["asyncio.Task[_R]"] = set()
+        self.order: Deque["asyncio.Task[_R]"] = deque()
+        # Calls finished since last checked, and future set when a call finishes
+        # or when the producer stops
+        self.completed: Deque["asyncio.Task[_R]"] = deque()
+        self.waiter: Optional["asyncio.Future[None]"] = None
+        # Task pulling the items and starting the calls, see produce
+        self.producer = asyncio.ensure_future(self.produce())
+        self.exhausted = False
+        # Error raised by the source of the items
+        self.error: Optional[Exception] = None
+
+    def _wake(self) -> None:
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def _on_done(self, task: "asyncio.Task[_R]") -> None:
+        self.completed.append(task)
+        self._wake()
+
+    async def produce(self) -> None:
+        """
+        Pull the items and start their calls, as long as fewer than `concurrency`
+        calls are running or waiting to be yielded
+        """
+        try:
+            while True:
+                await self.slots.acquire()
+                try:
+                    item = await self.source.__anext__()  # pylint: disable=unnecessary-dunder-call
+                except StopAsyncIteration:
+                    return
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire()
+                task = asyncio.ensure_future(self.func(item))
+                task.add_done_callback(self._on_done)
+                self.tasks.add(task)
+                if self.ordered:
+                    self.order.append(task)
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = e
+        finally:
+            self.exhausted = True
+            self._wake()
+
+    def _ready_task(self) -> Optional["asyncio.Task[_R]"]:
+        """
+        Return the next call to yield if it is finished
+        """
+        if not self.ordered:
+            return self.completed.popleft() if self.completed else None
+        # Raise errors as soon as they happen, not when their result is due
+        failed = [t for t in self.completed if not t.cancelled() and t.exception()]
+        self.completed.clear()
+        if failed:
+            return failed[0]
+        if self.order and self.order[0].done():
+            return self.order.popleft()
+        return None
+
+    async def next_task(self) -> Optional["asyncio.Task[_R]"]:
+        """
+        Wait for the next call to yield and return it, None once all were yielded
+        """
+        while True:
+            if self.error is not None:
+                raise self.error
+            task = self._ready_task()
+            if task is not None:
+                self.tasks.discard(task)
+                return task
+            if self.exhausted and not self.tasks:
+                return None
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+
+    async def close(self) -> None:
+        """
+        Cancel the producer and the running calls, and close the source of the items
+        """
+        self.producer.cancel()
+        for task in self.tasks:
+            task.remove_done_callback(self._on_done)
+            task.cancel()
+        await asyncio.wait({self.producer, *self.tasks})
+        await self.source.aclose()  # type: ignore
+
+
+async def bounded_map(
+    func: Callable[[_T], Awaitable[_R]],
+    items: Union[Iterable[_T], AsyncIterable[_T]],
+    concurrency: int = 16,
+    ordered: bool = True,
+    rate_limiter: Optional[TokenBucket] = None,
+) -> AsyncIterator[_R]:
+    """
+    Async generator yielding func(item) for each item of `items` (an iterable
+    or async iterable), running at most `concurrency` calls at the same time.
+    Results are yielded in the order of `items` if `ordered` is True,
+    otherwise as soon as they are ready (like asyncio.as_completed).
+    Items are pulled from `items` only when a call can start, and no call starts
+    while `concurrency` results wait to be consumed, so memory stays bounded
+    for large or infinite inputs and slow consumers slow down the producer.
+    Items are pulled and calls started in a background task, so results
+    are yielded without waiting for the next items or for `rate_limiter`.
+    If `rate_limiter` is given, each call takes a token from it before starting.
+    If a call raises, the exception is raised by the generator as soon as possible
+    (even if results of previous items are due first) and the other calls are cancelled.
+    Usage:
+
+    async for result in bounded_map(fetch, urls, concurrency=10):
+        ...
+
+    Sync code can iterate over it with make_sync(bounded_map)(fetch, urls).
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    state = _BoundedMap(func, items, concurrency, ordered, rate_limiter)
+    try:
+        while True:
+            task = await state.next_task()
+            if task is None:
+                return
+            result = task.result()
+            # Let the next call start while the result is consumed
+            state.slots.release()
+            yield result
+    finally:
+        await state.close()
+
+
+class CacheInfo(NamedTuple):
+    """
+    Statistics of a function decorated with async_cached
+    """
+
+    hits: int
+    misses: int
+    # Calls which awaited the result of a running call with the same arguments
+    coalesced: int
+    evictions: int
+    size: int
+    maxsize: Optional[int]
+    nbytes: int
+
+
+_KWARGS_MARK = object()
+
+
+def _make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Hashable:
+    if not kwargs:
+        return args
+    return args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+
+class _AsyncCache:  # pylint: disable=too-many-instance-attributes
+    """
+    Results of a function decorated with async_cached, in LRU order
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int],
+        ttl: Optional[float],
+        max_bytes: Optional[int],
+        sizeof: Callable[[Any], int],
+        name: Optional[str],
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self.pp_count: Optional[Callable[[str], None]] = None
+        if name is not None:
+            from .profiling import pp_count  # pylint: disable=import-outside-toplevel
+
+            self.pp_count = pp_count
+        # Result, expiration time and size of each cached call
+        self.entries: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self.running: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def event(self, name: str) -> None:
+        """
+        Count an event in the stats, and in the profiling counters if enabled
+        """
+        self.stats[name] += 1
+        if self.pp_count is not None:
+            self.pp_count(f"{self.name}.{name}")
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Return whether the result of `key` is cached, and the result
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if self.ttl is not None and entry[1] < time.monotonic():
+            self._remove(key)
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[0]
+
+    def store(self, key: Hashable, value: Any) -> None:
+        """
+        Cache the result `value` of `key`, evicting the least recently used results if needed
+        """
+        if key in self.entries:
+            self._remove(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        expires = time.monotonic() + self.ttl if self.ttl is not None else 0
+        self.entries[key] = (value, expires, size)
+        self.nbytes += size
+        while self.entries and (
+            (self.maxsize is not None and len(self.entries) > self.maxsize)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self.entries)))
+            self.event("evictions")
+
+    def on_done(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        """
+        Cache the result of the call `task`, errors are not cached
+        """
+        if self.running.get(key) is task:
+            del self.running[key]
+        if not task.cancelled() and task.exception() is None:
+            self.store(key, task.result())
+
+    def _remove(self, key: Hashable) -> None:
+        self.nbytes -= self.entries.pop(key)[2]
+
+    def clear(self) -> None:
+        """
+        Drop all the cached results
+        """
+        self.entries.clear()
+        self.nbytes = 0
+
+
+def async_cached(
+    maxsize: Optional[int] = 128,
+    ttl: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+    sizeof: Callable[[Any], int] = sys.getsizeof,
+    name: Optional[str] = None,
+) -> Callable[[_F], _F]:
+    """
+    Decorator caching the results of an async function by arguments (which must be hashable).
+    Concurrent calls with the same arguments share a single call of the function,
+    which is not cancelled if some of the callers are cancelled.
+    - maxsize: maximum number of cached results, None for no limit
+    - ttl: seconds after which a result expires, None for no expiration
+    - max_bytes: maximum total size of the cached results, as measured by
+      `sizeof` (by default sys.getsizeof, which does not count referenced objects)
+    - name: if given, hits, misses, coalesced calls and evictions are also counted
+      in the profiling event counters `name`.hits, `name`.misses... (see pp_count)
+    Least recently used results are evicted first, and errors are not cached.
+    The decorated function has cache_info() and cache_clear() methods.
+    Usage:
+
+    @async_cached(maxsize=1024, ttl=60)
+    async def fetch(url):
+        ...
+    """
+
+    def decorator(func: _F) -> _F:
+        cache = _AsyncCache(maxsize, ttl, max_bytes, sizeof, name)
+
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            key = _make_key(args, kwargs)
+            hit, value = cache.lookup(key)
+            if hit:
+                cache.event("hits")
+                return value
+            loop = asyncio.get_running_loop()
+            task = cache.running.get(key)
+            if task is not None and task.get_loop() is loop:
+                cache.event("coalesced")
+            else:
+                cache.event("misses")
+                task = loop.create_task(func(*args, **kwargs))
+                cache.running[key] = task
+                task.add_done_callback(partial(cache.on_done, key))
+            return await asyncio.shield(task)
+
+        def cache_info() -> CacheInfo:
+            return CacheInfo(
+                size=len(cache.entries), maxsize=maxsize, nbytes=cache.nbytes, **cache.stats
+            )
+
+        wrapper.cache_info = cache_info  # type: ignore
+        wrapper.cache_clear = cache.clear  # type: ignore
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+class _Pools:
+    """
+    Executors used by offload and pool_map, created on first use
+    """
+
+    executors: Dict[str, Executor] = {}
+    lock = threading.Lock()
+
+
+def get_pool(kind: str = "process", max_workers: Optional[int] = None) -> Executor:
+    """
+    Return the shared pool of `kind` ("process" or "thread") used by offload and
+    pool_map, creating it with `max_workers` workers (by default the number of CPUs
+    for processes, see ThreadPoolExecutor for threads) if needed.
+    To resize a pool, shut it down with shutdown_pools first.
+    """
+    pool = _Pools.executors.get(kind)
+    if pool is not None:
+        return pool
+    # pylint: disable=import-outside-toplevel
+    # The process pool imports multiprocessing, which is slow to import
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    with _Pools.lock:
+        if kind not in _Pools.executors:
+            if kind == "process":
+                _Pools.executors[kind] = ProcessPoolExecutor(max_workers)
+            elif kind == "thread":
+                _Pools.executors[kind] = ThreadPoolExecutor(
+                    max_workers, thread_name_prefix="frittomisto-pool"
+                )
+            else:
+                raise ValueError(f"Unknown pool kind {kind!r}, expected 'process' or 'thread'")
+        return _Pools.executors[kind]
+
+
+def warm_up_pool(kind: str = "process", max_workers: Optional[int] = None) -> None:
+    """
+    Create the pool of `kind` (see get_pool) and start its workers, so that the first
+    calls don't pay for starting them
+    """
+    pool = get_pool(kind, max_workers)
+    workers = getattr(pool, "_max_workers", 1)
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+
+
+@atexit.register
+def shutdown_pools(wait: bool = True) -> None:
+    """
+    Shut down the pools used by offload and pool_map, waiting for the running
+    calls if `wait` is True. Pools are created again if they are used later.
+    This is done at exit.
+    """
+    with _Pools.lock:
+        executors = list(_Pools.executors.values())
+        _Pools.executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def _forget_pools() -> None:
+    # The workers of the pools belong to the parent process
+    _Pools.executors = {}
+    _Pools.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+class _Offloaded:
+    """
+    Wrappers returned by offload, see _picklable
+    """
+
+    wrappers: "weakref.WeakSet[Callable[..., Any]]" = weakref.WeakSet()
+
+
+def _get_qualified(module: str, qualname: str) -> Any:
+    """
+    Return the object named `qualname` in `module` if it is imported, None otherwise
+    """
+    obj: Any = sys.modules.get(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name, None)
+    return obj
+
+
+class _FunctionRef:
+    """
+    Picklable reference to a module-level function whose name is bound to its
+    offload wrapper: workers import the wrapper and call the function it wraps
+    """
+
+    def __init__(self, func: Callable[..., Any]):
+        self.module: str = func.__module__
+        self.qualname: str = func.__qualname__
+        self._func: Optional[Callable[..., Any]] = None
+
+    def __getstate__(self) -> Tuple[str, str]:
+        return self.module, self.qualname
+
+    def __setstate__(self, state: Tuple[str, str]) -> None:
+        self.module, self.qualname = state
+        self._func = None
+
+    def resolve(self) -> Callable[..., Any]:
+        """
+        Return the function referenced
+        """
+        func = self._func
+        if func is None:
+            import importlib  # pylint: disable=import-outside-toplevel
+
+            importlib.import_module(self.module)
+            func = self._func = _get_qualified(self.module, self.qualname).__wrapped__
+        return func
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.resolve()(*args, **kwargs)
+
+
+def _picklable(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Return `func` in a form which can be sent to a process pool.
+    Pickle finds functions by name, which fails when the name is bound to the offload
+    wrapper of the function: in that case only, a reference to the name is returned.
+    """
+    module = getattr(func, "__module__", None)
+    qualname = getattr(func, "__qualname__", None)
+    if module is None or qualname is None:
+        return func
+    named = _get_qualified(module, qualname)
+    if named is not func and getattr(named, "__wrapped__", None) is func:
+        if named in _Offloaded.wrappers:
+            return _FunctionRef(func)
+    return func
+
+
+def _call_chunk(func: Callable[..., Any], chunk: List[Any]) -> List[Any]:
+    return [func(item) for item in chunk]
+
+
+def offload(
+    func: Optional[Callable[..., Any]] = None, *, kind: str = "process"
+) -> Any:
+    """
+    Decorator running a sync function in the shared pool of `kind` (see get_pool),
+    so that async code can await it without blocking the event loop:
+    "process" for CPU-bound functions, "thread" for functions which release the GIL
+    (I/O, C extensions). For process pools, the function must be defined at the top
+    level of a module, and its arguments and result must be picklable.
+    Usage:
+
+    @offload
+    def crunch(data):
+        ...
+
+    result = await crunch(data)
+    """
+    if func is None:
+        return partial(offload, kind=kind)
+
+    target: Optional[Callable[..., Any]] = None if kind == "process" else func
+
+    @wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        nonlocal target
+        if target is None:
+            # The name of func is bound to the wrapper only once decorated
+            target = _picklable(func)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_pool(kind), partial(target, *args, **kwargs))
+
+    _Offloaded.wrappers.add(wrapper)
+    return wrapper
+
+
+async def pool_map(
+    func: Callable[[_T], _R],
+    items: Iterable[_T],
+    kind: str = "process",
+    chunksize: Optional[int] = None,
+) -> List[_R]:
+    """
+    Return [func(item) for item in items], computed in the shared pool of `kind`
+    (see offload and get_pool). Items are sent to the workers in chunks of `chunksize`
+    items, to amortize the cost of sending each call, by default about 4 chunks per worker.
+    """
+    items = list(items)
+    pool = get_pool(kind)
+    size = chunksize
+    if size is None:
+        workers = getattr(pool, "_max_workers", 1)
+        size = max(1, -(-len(items) // (4 * workers)))
+    target = _picklable(func) if kind == "process" else func
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(
+        *(
+            loop.run_in_executor(pool, _call_chunk, target, items[i : i + size])
+            for i in range(0, len(items), size)
+        )
+    )
+    return [result for chunk in chunks for result in chunk]
@@ -1,12 +1,170 @@
 """
 Module to manage config files
 """
-from typing import Any, Dict, Union, List, Optional
+from typing import Any, Callable, Dict, Union, List, Optional, Tuple
 from pathlib import Path
-import toml
+import os
+import threading
+import time
 
+# Config files found by _find_config, by working directory and config names:
+# the path of the file, the paths of the closer candidates, which did not exist,
+# and the time when they were last checked
+_found_configs: Dict[Tuple[str, Tuple[str, ...]], Tuple[str, Tuple[str, ...], float]] = {}
+# Seconds during which a found config file is used without being checked again,
+# when auto reload is disabled (otherwise its interval is used)
+_FOUND_CONFIG_TTL = 1.0
 
-class FrittoMistoCfg:
+# Separator of the levels of the names of environment variables, e.g. PREFIX__A__B
+_ENV_SEPARATOR = "__"
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return `base` updated recursively with `override`: tables are merged,
+    other values of `override` replace the ones of `base`
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _env_config(prefix: str) -> Dict[str, Any]:
+    """
+    Return the config set by the environment variables named PREFIX__A__B...,
+    e.g. PREFIX__A__B=1 sets cfg['a']['b'] to 1. Values are parsed as TOML values
+    if possible (e.g. 1, true, [1, 2]), otherwise they are strings.
+    """
+    import toml  # pylint: disable=import-outside-toplevel
+
+    config: Dict[str, Any] = {}
+    start = prefix + _ENV_SEPARATOR
+    for name, value in os.environ.items():
+        if not name.startswith(start) or len(name) == len(start):
+            continue
+        *parents, key = name[len(start):].lower().split(_ENV_SEPARATOR)
+        table = config
+        for parent in parents:
+            table = table.setdefault(parent, {})
+        try:
+            table[key] = toml.loads(f"v = {value}")["v"]
+        except toml.TomlDecodeError:
+            table[key] = value
+    return config
+
+
+def _flatten(key: str, value: Any, index: Dict[str, Any]) -> None:
+    """
+    Add `value` to `index` with the dotted key `key`, and the values of its tables
+    with the keys `key`.subkey, recursively
+    """
+    index[key] = value
+    if isinstance(value, dict):
+        for subkey, subvalue in value.items():
+            _flatten(f"{key}.{subkey}", subvalue, index)
+
+
+def _update_index(
+    index: Dict[str, Any], old_config: Dict[str, Any], config: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Return the flat index of `config`, given the `index` of `old_config`.
+    Only the top-level keys which changed are flattened again.
+    """
+    index = dict(index)
+    for key in old_config.keys() - config.keys():
+        for dotted in [k for k in index if k == key or k.startswith(key + ".")]:
+            del index[dotted]
+    for key, value in config.items():
+        if key in old_config and old_config[key] == value:
+            continue
+        if key in old_config:
+            for dotted in [k for k in index if k == key or k.startswith(key + ".")]:
+                del index[dotted]
+        _flatten(key, value, index)
+    return index
+
+
+# Bumped when the format of the cached configs changes
+_CACHE_VERSION = 1
+_CacheKey = Tuple[int, str, int, int, str]
+
+
+def _cache_path(cache_dir: str, config_file: str) -> str:
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    name = hashlib.sha256(config_file.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{name}.pickle")
+
+
+def _load_cached(config_file: str, cache_dir: str) -> Dict[str, Any]:
+    """
+    Load the config file from its cached snapshot in `cache_dir` if it is still valid,
+    otherwise parse it and cache it. A snapshot is valid if the path, modification
+    time, size and sha256 of the config file did not change.
+    """
+    # pylint: disable=import-outside-toplevel
+    import hashlib
+    import pickle
+    import toml
+
+    config_file = os.path.abspath(config_file)
+    with open(config_file, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    key: _CacheKey = (
+        _CACHE_VERSION,
+        config_file,
+        stat.st_mtime_ns,
+        stat.st_size,
+        hashlib.sha256(data).hexdigest(),
+    )
+    cache_path = _cache_path(cache_dir, config_file)
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, config = pickle.load(f)
+        if cached_key == key:
+            return config
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+        pass
+
+    config = toml.loads(data.decode("utf-8"))
+    _write_cache(cache_path, key, config)
+    return config
+
+
+def _write_cache(cache_path: str, key: _CacheKey, config: Dict[str, Any]) -> None:
+    """
+    Write a config snapshot atomically, so that readers never see a partial snapshot.
+    Failing to write the snapshot is not an error, the config will be parsed again.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pickle
+    import tempfile
+
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=cache_dir, prefix=".", suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = f.name
+            try:
+                pickle.dump((key, config), f, protocol=pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                f.close()
+                os.remove(tmp_path)
+                return
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+
+class FrittoMistoCfg:  # pylint: disable=too-many-instance-attributes
     """
     Class to manage the frittomisto config files.
     The config file is a TOML file, and the default name is frittomisto.toml and it
@@ -15,22 +173,123 @@ class FrittoMistoCfg:
     The API of this class is similar to the one of python Dicts:
     - cfg['key'] has a similar effect to dict['key']
     - cfg.get('key', default) has a similar effect to dict.get('key', default)
+    Nested values can be read with dotted keys, e.g. cfg.get('a.b.c') is
+    cfg['a']['b']['c'], in a single lookup.
+
+    The config is merged from several layers, each one overriding the previous ones:
+    the defaults (see set_defaults), the config file, the extra config files (see
+    set_extra_config_files) and the environment variables (see set_env_prefix).
 
     It is possible to modify the behaviour of this class by calling the
     "set_" methods. For example, to set the config file to use, call
     set_config_file('path/to/config.toml').
+
+    With set_auto_reload, the config is reloaded when the config file changes,
+    and the callbacks registered with subscribe are called with the new config.
     """
 
     def __init__(self):
         self._config: Optional[Dict[str, Any]] = None
         self._config_names: List[str] = ["frittomisto.toml"]
         self._config_file: Optional[str] = None
+        # Modification time and size of the config files when they were loaded
+        self._config_stat: Optional[Tuple[Tuple[int, int], ...]] = None
+        self._lock = threading.RLock()
+        self._reload_interval: Optional[float] = None
+        # Time of the next check for changes done by _get_config, None if disabled
+        self._next_check: Optional[float] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watcher = threading.Event()
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self._cache_dir: Optional[str] = None
+        self._defaults: Dict[str, Any] = {}
+        self._extra_config_files: List[str] = []
+        self._env_prefix: Optional[str] = None
+        # Values of the config by dotted key, see _update_index
+        self._index: Dict[str, Any] = {}
 
     def set_config_file(self, config_file: Optional[str]) -> None:
         """
         Set the config file to use
         """
-        self._config_file = config_file
+        with self._lock:
+            self._config_file = config_file
+            self._config = None
+            self._config_stat = None
+
+    def set_defaults(self, defaults: Dict[str, Any]) -> None:
+        """
+        Set the default values of the config, overridden by the config files
+        """
+        with self._lock:
+            self._defaults = defaults
+            self._config = None
+
+    def set_extra_config_files(self, config_files: List[str]) -> None:
+        """
+        Set config files merged over the config file, in order of priority
+        (the last one overrides the others)
+        """
+        with self._lock:
+            self._extra_config_files = list(config_files)
+            self._config = None
+            self._config_stat = None
+
+    def set_env_prefix(self, prefix: Optional[str]) -> None:
+        """
+        Override the config with the environment variables named `prefix`__KEY__SUBKEY...,
+        e.g. with prefix MYAPP, MYAPP__FOO__BAR=1 sets cfg['foo']['bar'] to 1.
+        Values are parsed as TOML values, or used as strings if they are not valid TOML.
+        If `prefix` is None (the default), environment variables are ignored.
+        """
+        with self._lock:
+            self._env_prefix = prefix
+            self._config = None
+
+    def set_cache_dir(self, cache_dir: Optional[str]) -> None:
+        """
+        Cache parsed config files in `cache_dir`, so that other processes loading
+        the same config file don't need to parse it again (as long as it does not change).
+        The cache is stored with pickle: only use a directory which is not writable by
+        untrusted users. If `cache_dir` is None (the default), configs are not cached.
+        """
+        self._cache_dir = cache_dir
+
+    def set_auto_reload(self, interval: Optional[float] = 1.0, watch: bool = False) -> None:
+        """
+        Reload the config when the config files change (their modification time or size).
+        The config file is checked at most once every `interval` seconds when reading
+        the config, or if `watch` is True, every `interval` seconds by a background
+        thread, so that reading the config has no overhead.
+        If `interval` is None, disable auto reload.
+        """
+        # The watcher takes the lock, stop it before taking it
+        self._stop_watch()
+        with self._lock:
+            self._reload_interval = interval
+            self._next_check = None
+            if interval is None:
+                return
+            if not watch:
+                self._next_check = time.monotonic()
+                return
+            self._stop_watcher = threading.Event()
+            self._watcher = threading.Thread(
+                target=self._watch, args=(self._stop_watcher, interval), daemon=True
+            )
+            self._watcher.start()
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Call `callback` with the new config each time the config is reloaded and changed
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Stop calling `callback` when the config changes, see subscribe
+        """
+        self._subscribers.remove(callback)
 
     def set_config_names(self, config_names: Union[str, List[str]]) -> None:
         """
@@ -56,52 +315,158 @@ class FrittoMistoCfg:
         """
         Reload the config from the config file
         """
-        self._config = self._reload_config()
+        with self._lock:
+            if self._config_file is None:
+                self._config_file = self._find_config()
+            self._load_config()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the config if the config file changed since it was loaded,
+        return whether it was reloaded.
+        The config is not reloaded if the config file is missing or invalid,
+        e.g. while it is being rewritten.
+        """
+        import toml  # pylint: disable=import-outside-toplevel
+
+        with self._lock:
+            if self._next_check is not None:
+                assert self._reload_interval is not None
+                self._next_check = time.monotonic() + self._reload_interval
+            if self._config_file is None:
+                return False
+            try:
+                if self._stat_config() == self._config_stat:
+                    return False
+                self._load_config()
+            except (OSError, toml.TomlDecodeError):
+                return False
+            return True
 
     def get(self, key: str, default: Optional[Any] = None) -> Any:
         """
-        Get a config value
+        Get a config value, `key` can be a dotted key, e.g. 'a.b.c'
         """
-        return self._get_config().get(key, default)
+        if self._config is None or self._next_check is not None:
+            self._get_config()
+        return self._index.get(key, default)
 
     def __getitem__(self, __name: str) -> Any:
         """
-        Get a config value
+        Get a config value, `__name` can be a dotted key, e.g. 'a.b.c'
         """
-        return self._get_config()[__name]
+        if self._config is None or self._next_check is not None:
+            self._get_config()
+        return self._index[__name]
 
     def __setitem__(self, __name: str, __value: Any) -> None:
         raise NotImplementedError("Setting config values is not yet implemented")
 
     def _get_config(self) -> Dict[str, Any]:
-        # Find the config file if it hasn't been found yet
-        if self._config_file is None:
-            self._config_file = self._find_config()
+        config = self._config
+        if config is not None:
+            if self._next_check is not None and time.monotonic() >= self._next_check:
+                self.reload_if_changed()
+                return self._config or config
+            return config
 
-        if self._config is None:
-            self._config = self._reload_config()
+        with self._lock:
+            # Find the config file if it hasn't been found yet
+            if self._config_file is None:
+                self._config_file = self._find_config()
 
-        return self._config
+            if self._config is None:
+                self._load_config()
+            assert self._config is not None
+            return self._config
+
+    def _stat_config(self) -> Tuple[Tuple[int, int], ...]:
+        assert self._config_file is not None
+        stats = [os.stat(f) for f in [self._config_file, *self._extra_config_files]]
+        return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+    def _load_config(self) -> None:
+        """
+        Load the config, and notify the subscribers if the config changed
+        """
+        # Stat before reading, so that changes done while reading are seen by the next check
+        stat = self._stat_config()
+        config = self._reload_config()
+        old_config = self._config
+        self._index = _update_index(self._index if old_config else {}, old_config or {}, config)
+        self._config, self._config_stat = config, stat
+        if old_config is not None and config != old_config:
+            for callback in list(self._subscribers):
+                callback(config)
+
+    def _watch(self, stop: threading.Event, interval: float) -> None:
+        """
+        Body of the thread watching the config file, see set_auto_reload
+        """
+        while not stop.wait(interval):
+            if self._config is not None:
+                self.reload_if_changed()
+
+    def _stop_watch(self) -> None:
+        if self._watcher is not None:
+            self._stop_watcher.set()
+            if self._watcher is not threading.current_thread():
+                self._watcher.join()
+            self._watcher = None
 
     def _reload_config(self) -> Dict[str, Any]:
         """
-        Reload the config from the config file
+        Reload the config from its layers: defaults, config files and environment variables
         """
         if self._config_file is None:
             raise ValueError("No config file set")
 
-        with open(self._config_file, encoding="utf-8") as f:
+        config = _merge(self._defaults, self._read_config_file(self._config_file))
+        for config_file in self._extra_config_files:
+            config = _merge(config, self._read_config_file(config_file))
+        if self._env_prefix is not None:
+            config = _merge(config, _env_config(self._env_prefix))
+        return config
+
+    def _read_config_file(self, config_file: str) -> Dict[str, Any]:
+        if self._cache_dir is not None:
+            return _load_cached(config_file, self._cache_dir)
+
+        import toml  # pylint: disable=import-outside-toplevel
+
+        with open(config_file, encoding="utf-8") as f:
             config = toml.load(f)
         return config
 
     def _find_config(self) -> str:
         """
-        Find config file in the current directory or its parents
+        Find config file in the current directory or its parents.
+        The result is cached per working directory, and checked again at most once
+        per auto reload interval (see set_auto_reload, 1 second if disabled): it is
+        used as long as the file exists and no closer candidate (e.g. in a
+        subdirectory) was created.
         """
-        for directory in [Path("."), *Path(".").absolute().parents]:
+        key = (os.getcwd(), tuple(self._config_names))
+        cached = _found_configs.get(key)
+        now = time.monotonic()
+        if cached is not None:
+            found, closer, checked = cached
+            ttl = _FOUND_CONFIG_TTL if self._reload_interval is None else self._reload_interval
+            if now < checked + ttl:
+                return found
+            if os.path.exists(found) and not any(map(os.path.exists, closer)):
+                _found_configs[key] = (found, closer, now)
+                return found
+
+        cwd = Path(key[0])
+        candidates: List[str] = []
+        for directory in [cwd, *cwd.parents]:
             for name in self._config_names:
-                if (directory / name).exists():
-                    return str(directory / name)
+                candidate = str(directory / name)
+                if os.path.exists(candidate):
+                    _found_configs[key] = (candidate, tuple(candidates), now)
+                    return candidate
+                candidates.append(candidate)
 
         raise FileNotFoundError("Could not find config file in current directory or its parents")
 
@@ -1,110 +1,996 @@
 """
 Utilities for working with JSON
 """
+import codecs
+import io
 import json
-from dataclasses import dataclass
-from typing import Dict, get_args, get_origin, Union, Any, get_type_hints
+import mmap
+import os
+import re
+from array import array
+from dataclasses import dataclass, fields, Field, MISSING
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+from typing import (
+    ClassVar,
+    Dict,
+    Callable,
+    Optional,
+    List,
+    Tuple,
+    Type,
+    TypeVar,
+    Generic,
+    MutableSequence,
+    IO,
+    Iterable,
+    Iterator,
+    get_args,
+    get_origin,
+    Union,
+    Any,
+    get_type_hints,
+    TYPE_CHECKING,
+)
 
 try:
     from typing import Self
 except ImportError:
     # Python 3.7 compatibility
-    from typing import Generic as Self
+    from typing import Generic as Self  # pylint: disable=reimported
+
+
+# A converter takes a decoded JSON value and fits it to a python type
+_Converter = Callable[[Any], Any]
+
+_NoneType = type(None)
+
+# Compiled decoders and encoders, one per JSONSerializable subclass
+_decoders: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+_lazy_decoders: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+_encoders: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+_shallow_encoders: Dict[type, Callable[[Any], Dict[str, Any]]] = {}
+
+# __slots__ based variants of JSONSerializable subclasses
+_slotted: Dict[type, type] = {}
+
+# Typecodes of the arrays used to store primitive columns of a JSONBatch
+_COLUMN_TYPECODES = {int: "q", float: "d"}
+_BATCH_CHUNK_SIZE = 4096
+
+# Size of the chunks written and read by the streaming functions
+_WRITE_CHUNK_SIZE = 1 << 16
+_READ_CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+# Converters of the containers declared without type arguments, e.g. `xs: list`
+_UNTYPED_CONTAINERS: Dict[Any, _Converter] = {list: list, set: list, tuple: tuple, dict: dict}
+
+# Sources accepted by JSONSerializable.from_json
+JSONSource = Union[str, bytes, bytearray, memoryview, "os.PathLike[str]", IO[Any]]
+
+
+class _Parser:
+    """
+    The parser used to decode JSON documents, see set_json_parser
+    """
+
+    loads: Callable[[Any], Any] = json.loads
+    # Whether `loads` accepts buffers (e.g. memoryview) without copying them
+    accepts_buffers: bool = False
+
+
+def _compile_converter(cc: Any, lazy: bool = False) -> Optional[_Converter]:
+    """
+    Compile the type `cc` into a converter function.
+    Returns None when values of type `cc` can be used as they are.
+    If `lazy` is True, JSONSerializable objects are decoded lazily.
+    """
+    cc_orig = get_origin(cc) or cc
+    args = get_args(cc)
+
+    # If the type is None or a primitive, use the value as is
+    if cc is None or cc_orig in {str, int, float, bool, Any}:
+        return None
+
+    if cc_orig is _NoneType:
+        return _fit_none
+
+    # Containers without type arguments hold untyped values
+    if not args and cc_orig in _UNTYPED_CONTAINERS:
+        return _UNTYPED_CONTAINERS[cc_orig]
+
+    # If the type is a list or set, convert each element
+    if cc_orig in {list, set}:
+        element_conv = _compile_converter(args[0], lazy)
+        if element_conv is None:
+            return list
+        return lambda v: [element_conv(x) for x in v]
+
+    # If the field is a tuple, convert each element
+    if cc_orig == tuple:
+        if len(args) == 2 and args[1] is Ellipsis:
+            element_conv = _compile_converter(args[0], lazy)
+            if element_conv is None:
+                return tuple
+            return lambda v: tuple(element_conv(x) for x in v)
+        convs = [_compile_converter(a, lazy) or _identity for a in args]
+        return lambda v: tuple(conv(x) for conv, x in zip(convs, v))
+
+    # If the field is a dict, convert each element
+    if cc_orig == dict:
+        key_conv, value_conv = (_compile_converter(a, lazy) for a in args)
+        if key_conv is None and value_conv is None:
+            return dict
+        key_conv = key_conv or _identity
+        value_conv = value_conv or _identity
+        return lambda v: {key_conv(kk): value_conv(vv) for kk, vv in v.items()}
+
+    # If the field is a Union, try each type until one works
+    if cc_orig == Union:
+        return _compile_union(cc, lazy)
+
+    # If the field is a JSONSerializable, convert it
+    if isinstance(cc_orig, type) and issubclass(cc_orig, JSONSerializable):
+        # Children are looked up lazily, so that recursive types are supported
+        return _child_decoder(cc_orig, lazy)
+
+    # Otherwise, raise an error when a value is met
+    def _unknown_type(v: Any) -> Any:
+        raise RuntimeError(f"Unknown type {cc}")
+
+    return _unknown_type
+
+
+def _child_decoder(cls: Any, lazy: bool) -> _Converter:
+    return partial(cls.from_dict, lazy=True) if lazy else cls.from_dict
+
+
+def _compile_union(cc: Any, lazy: bool = False) -> Optional[_Converter]:
+    """
+    Compile a Union type into a converter.
+    If all the JSONSerializable members of the Union declare a tag, values are
+    dispatched on their tag, otherwise each member is tried in order.
+    """
+    members = get_args(cc)
+    convs = [_compile_converter(a, lazy) for a in members]
+    if convs[0] is None:
+        # The first member accepts anything, no need to try the others
+        return None
+
+    def _fit_union(v: Any) -> Any:
+        for conv in convs:
+            if conv is None:
+                return v
+            try:
+                return conv(v)
+            except Exception:  # pylint: disable=broad-except
+                pass
+        raise RuntimeError(f"Could not fit {v!r} to {cc}")
+
+    serializables = [
+        m for m in members if isinstance(m, type) and issubclass(m, JSONSerializable)
+    ]
+    tags = [_get_tag(m) for m in serializables]
+    if not serializables or None in tags or len({field for field, _ in tags}) != 1:  # type: ignore
+        return _fit_union
+
+    tag_field = tags[0][0]  # type: ignore
+    table = {
+        tag: _child_decoder(m, lazy) for (_, tag), m in zip(tags, serializables)  # type: ignore
+    }
+    if len(table) != len(serializables):
+        raise TypeError(f"Duplicate JSON tags in {cc}")
+
+    def _fit_tagged_union(v: Any) -> Any:
+        if isinstance(v, dict):
+            decoder = table.get(v.get(tag_field))  # type: ignore
+            if decoder is not None:
+                return decoder(v)
+        return _fit_union(v)
+
+    return _fit_tagged_union
+
+
+def _identity(v: Any) -> Any:
+    return v
+
+
+def _fit_none(v: Any) -> Any:
+    if v is not None:
+        raise TypeError(f"Expected None, got {v!r}")
+    return v
+
+
+def _get_tag(cls: type) -> Optional[Tuple[str, str]]:
+    """
+    Return the (field, tag) pair declared by the class `cls`, if any.
+    Tags are not inherited, each class of a tagged union declares its own.
+    """
+    tag = cls.__dict__.get("__json_tag__")
+    if tag is None:
+        return None
+    return cls.__json_tag_field__, tag  # type: ignore
+
+
+def _get_extra_tag(cls: type) -> Optional[Tuple[str, str]]:
+    """
+    Return the (field, tag) pair to add to the encoded objects of class `cls`,
+    i.e. the tag of the class unless it is already stored in one of its fields.
+    """
+    tag = _get_tag(cls)
+    if tag is None or tag[0] in {f.name for f in fields(cls)}:
+        return None
+    return tag
+
+
+def _compile_decoder(cls: type) -> Callable[[Dict[str, Any]], Any]:
+    """
+    Compile the decoder of a JSONSerializable subclass.
+    The decoder only converts the fields which need it,
+    all the other values are passed as they are to the constructor.
+    """
+    hints = get_type_hints(cls)
+    convs: Dict[str, _Converter] = {}
+    for f in fields(cls):
+        conv = _compile_converter(hints.get(f.name, Any))
+        if conv is not None:
+            convs[f.name] = conv
+
+    tag = _get_extra_tag(cls)
+    if not convs and tag is None:
+        return lambda d: cls(**d)
+
+    def _decode(d: Dict[str, Any]) -> Any:
+        kwargs = d.copy()
+        if tag is not None:
+            kwargs.pop(tag[0], None)
+        for k, conv in convs.items():
+            if k in kwargs:
+                kwargs[k] = conv(kwargs[k])
+        return cls(**kwargs)
+
+    return _decode
+
+
+def _get_lazy_fields(cls: type) -> List[str]:
+    """
+    Return the fields of `cls` which can be decoded lazily: the ones with
+    no class attribute (i.e. no plain default value) shadowing the instance lookup.
+    Classes with a __post_init__ or without __dict__ have no lazy fields.
+    """
+    if hasattr(cls, "__post_init__") or "__dict__" not in dir(cls):
+        return []
+    hints = get_type_hints(cls)
+    return [
+        f.name
+        for f in fields(cls)
+        if not hasattr(cls, f.name) and _compile_converter(hints.get(f.name, Any)) is not None
+    ]
+
+
+def _compile_lazy_decoder(cls: type) -> Callable[[Dict[str, Any]], Any]:
+    """
+    Compile the lazy decoder of a JSONSerializable subclass.
+    Fields needing a conversion are kept as they are and decoded on first access,
+    the constructor is bypassed so that they are not touched.
+    """
+    lazy_fields = set(_get_lazy_fields(cls))
+    if not lazy_fields:
+        return _compile_decoder(cls)
+
+    hints = get_type_hints(cls)
+    convs = {f.name: _compile_converter(hints.get(f.name, Any), lazy=True) for f in fields(cls)}
+    defaults = [(f.name, f.default, f.default_factory) for f in fields(cls)]
+    tag = _get_extra_tag(cls)
+
+    def _decode(d: Dict[str, Any]) -> Any:
+        obj = cls.__new__(cls)  # type: ignore
+        values = obj.__dict__
+        pending: Dict[str, Tuple[_Converter, Any]] = {}
+        for k, v in d.items():
+            if k in lazy_fields:
+                pending[k] = (convs[k], v)  # type: ignore
+            elif k in convs:
+                conv = convs[k]
+                values[k] = v if conv is None else conv(v)
+            elif tag is None or k != tag[0]:
+                raise TypeError(f"{cls.__name__} got an unexpected field '{k}'")
+        for name, default, default_factory in defaults:
+            if name in values or name in pending:
+                continue
+            if default is not MISSING:
+                values[name] = default
+            elif default_factory is not MISSING:
+                values[name] = default_factory()
+            else:
+                raise TypeError(f"{cls.__name__} missing required field '{name}'")
+        if pending:
+            values["_json_pending"] = pending
+        return obj
+
+    return _decode
+
+
+def _compile_encoder_converter(cc: Any) -> Optional[_Converter]:
+    """
+    Compile the type `cc` into a function converting values to JSON compatible ones.
+    Returns None when values of type `cc` can be used as they are.
+    """
+    cc_orig = get_origin(cc) or cc
+
+    # Primitives are already JSON compatible
+    if cc_orig in {str, int, float, bool, _NoneType}:
+        return None
+
+    # If the type is a list, set or tuple, convert each element
+    if cc_orig in {list, set, tuple}:
+        args = [a for a in get_args(cc) if a is not Ellipsis]
+        element_convs = [_compile_encoder_converter(a) for a in args]
+        if not args or len(set(element_convs)) != 1:
+            return _encode_any
+        element_conv = element_convs[0]
+        if element_conv is None:
+            return list
+        return lambda v: [element_conv(x) for x in v]
+
+    # If the field is a dict, convert each value
+    if cc_orig == dict:
+        args = get_args(cc)
+        value_conv = _compile_encoder_converter(args[1]) if args else _encode_any
+        if value_conv is None:
+            return dict
+        return lambda v: {kk: value_conv(vv) for kk, vv in v.items()}
+
+    # A Union of primitives is JSON compatible too
+    if cc_orig == Union and all(
+        _compile_encoder_converter(a) is None for a in get_args(cc)
+    ):
+        return None
+
+    # Otherwise (e.g. JSONSerializable fields), inspect the value at runtime
+    return _encode_any
+
+
+def _encode_any(v: Any) -> Any:
+    """
+    Convert a value of unknown type to a JSON compatible one
+    """
+    if isinstance(v, JSONSerializable):
+        return v.to_dict()
+    if isinstance(v, (list, set, tuple)):
+        return [_encode_any(x) for x in v]  # type: ignore
+    if isinstance(v, dict):
+        return {kk: _encode_any(vv) for kk, vv in v.items()}  # type: ignore
+    return v
+
+
+def _compile_encoder(cls: type) -> Callable[[Any], Dict[str, Any]]:
+    """
+    Compile the encoder of a JSONSerializable subclass.
+    The layout of the fields is known in advance, so primitive fields
+    are copied without inspecting their values.
+    """
+    hints = get_type_hints(cls)
+    plan: List[Tuple[str, Optional[_Converter]]] = [
+        (f.name, _compile_encoder_converter(hints.get(f.name, Any))) for f in fields(cls)
+    ]
+    tag = _get_extra_tag(cls)
+
+    def _encode(obj: Any) -> Dict[str, Any]:
+        ret: Dict[str, Any] = {} if tag is None else {tag[0]: tag[1]}
+        for name, conv in plan:
+            v = getattr(obj, name)
+            ret[name] = v if conv is None else conv(v)
+        return ret
+
+    if not _get_lazy_fields(cls):
+        return _encode
+
+    def _encode_lazy(obj: Any) -> Dict[str, Any]:
+        raw = _get_pending_raw(obj)
+        if not raw:
+            return _encode(obj)
+        ret: Dict[str, Any] = {} if tag is None else {tag[0]: tag[1]}
+        for name, conv in plan:
+            if name in raw:
+                ret[name] = raw[name]
+            else:
+                v = getattr(obj, name)
+                ret[name] = v if conv is None else conv(v)
+        return ret
+
+    return _encode_lazy
+
+
+def _get_pending_raw(obj: Any) -> Optional[Dict[str, Any]]:
+    """
+    Return the raw values of the fields of a lazily decoded object
+    which have not been accessed yet, or None if the object is not lazy.
+    """
+    values = obj.__dict__
+    pending = values.get("_json_pending")
+    if pending is None:
+        return None
+    return {name: raw for name, (_, raw) in pending.items() if name not in values}
+
+
+def _compile_shallow_encoder(cls: type) -> Callable[[Any], Dict[str, Any]]:
+    """
+    Compile a function returning the fields of an object without converting them.
+    Classes overriding to_dict are encoded with it.
+    """
+    if cls.to_dict is not JSONSerializable.to_dict:  # type: ignore
+        return cls.to_dict  # type: ignore
+    names = tuple(f.name for f in fields(cls))
+    tag = _get_extra_tag(cls)
+
+    def _encode(o: Any) -> Dict[str, Any]:
+        if tag is None:
+            return {name: getattr(o, name) for name in names}
+        return {tag[0]: tag[1], **{name: getattr(o, name) for name in names}}
+
+    if not _get_lazy_fields(cls):
+        return _encode
+
+    def _encode_lazy(o: Any) -> Dict[str, Any]:
+        raw = _get_pending_raw(o)
+        if not raw:
+            return _encode(o)
+        ret: Dict[str, Any] = {} if tag is None else {tag[0]: tag[1]}
+        for name in names:
+            ret[name] = raw[name] if name in raw else getattr(o, name)
+        return ret
+
+    return _encode_lazy
+
+
+def _json_default(o: Any) -> Any:
+    """
+    Hook for the json encoder, called for each object it cannot serialize.
+    JSONSerializable objects are expanded one level at a time, so that
+    the encoder never sees the whole tree as an intermediate dict.
+    """
+    if isinstance(o, JSONSerializable):
+        cls = type(o)
+        try:
+            encoder = _shallow_encoders[cls]
+        except KeyError:
+            encoder = _shallow_encoders[cls] = _compile_shallow_encoder(cls)
+        return encoder(o)
+    if isinstance(o, set):
+        return list(o)  # type: ignore
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+_json_encoder = json.JSONEncoder(default=_json_default)
+
+
+def _is_binary(fp: IO[Any]) -> bool:
+    """
+    Check if the file object `fp` expects bytes
+    """
+    return isinstance(fp, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(fp, "mode", "")
+
+
+def _text_reader(fp: IO[Any]) -> Callable[[int], str]:
+    """
+    Return a function reading up to n characters from the text or binary file object `fp`
+    """
+    if not _is_binary(fp):
+        return fp.read
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def _read(n: int) -> str:
+        data = fp.read(n)
+        return decoder.decode(data, final=not data)
+
+    return _read
+
+
+def set_json_parser(
+    parser: Union[str, Callable[[Any], Any], None] = None, accepts_buffers: bool = False
+) -> None:
+    """
+    Set the parser used to decode JSON documents:
+    - "json" or None: the json module of the standard library (default)
+    - "orjson": the orjson package, raises ImportError if it is not installed
+    - "auto": orjson if it is installed, json otherwise
+    - a function taking a str or bytes document and returning the decoded value,
+      set accepts_buffers to True if it also accepts memoryviews
+    """
+    if parser == "auto":
+        try:
+            set_json_parser("orjson")
+        except ImportError:
+            set_json_parser("json")
+    elif parser is None or parser == "json":
+        _Parser.loads = json.loads
+        _Parser.accepts_buffers = False
+    elif parser == "orjson":
+        import orjson  # pylint: disable=import-outside-toplevel,import-error
+
+        _Parser.loads = orjson.loads  # type: ignore # pylint: disable=no-member
+        _Parser.accepts_buffers = True
+    elif callable(parser):
+        _Parser.loads = parser
+        _Parser.accepts_buffers = accepts_buffers
+    else:
+        raise ValueError(f"Unknown JSON parser {parser!r}")
+
+
+def _parse_buffer(buf: Any) -> Any:
+    """
+    Parse a buffer (e.g. memoryview or mmap), without copying it when the parser allows it
+    """
+    if _Parser.accepts_buffers:
+        with memoryview(buf) as view:
+            return _Parser.loads(view)
+    return _Parser.loads(str(buf, "utf-8"))
+
+
+def _parse_file(fp: IO[Any]) -> Any:
+    """
+    Parse a file object, memory-mapping it when possible
+    """
+    if _is_binary(fp):
+        try:
+            fd, offset = fp.fileno(), fp.tell()
+        except (OSError, AttributeError):
+            fd, offset = -1, -1
+        if offset == 0 and os.fstat(fd).st_size > 0:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                return _parse_buffer(mapped)
+    return _Parser.loads(fp.read())
+
+
+def _parse(src: JSONSource) -> Any:
+    """
+    Parse a JSON document from a string, a bytes-like object, a path or a file object
+    """
+    if isinstance(src, (str, bytes, bytearray)):
+        return _Parser.loads(src)
+    if isinstance(src, memoryview):
+        return _parse_buffer(src)
+    if isinstance(src, os.PathLike):
+        with open(src, "rb") as fp:
+            return _parse_file(fp)
+    return _parse_file(src)
+
+
+def _iter_json_array(fp: IO[Any], chunk_size: int) -> Iterator[Any]:
+    """
+    Incrementally decode the elements of a top-level JSON array.
+    Only the element being decoded and one chunk are kept in memory.
+    """
+    read = _text_reader(fp)
+    decoder = json.JSONDecoder()
+    buf, pos = "", 0
+    eof = False
+    expect = "["
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()  # type: ignore
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        if expect == "[":
+            if buf[pos] != "[":
+                raise ValueError(f"Expected '[' at the start of a JSON array, got {buf[pos]!r}")
+            pos += 1
+            expect = "first"
+        elif expect in {",", "first"} and buf[pos] == "]":
+            return
+        elif expect == ",":
+            if buf[pos] != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {buf[pos]!r}")
+            pos += 1
+            expect = "value"
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                value, end = None, len(buf)
+            if not eof and (
+                end == len(buf)
+                # A number cut by the end of the chunk, e.g. "1." or "3e"
+                or isinstance(value, (int, float)) and _NUMBER_TAIL.fullmatch(buf, end)
+            ):
+                # The value might continue in the next chunk, read at least
+                # as much as we already have to avoid quadratic re-decoding
+                chunk = read(max(chunk_size, len(buf) - pos))
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield value
+            pos = end
+            expect = ","
+
+
+def _make_slotted(cls: type) -> type:
+    """
+    Create a copy of the dataclass `cls` storing its fields in __slots__
+    """
+    inherited = {slot for base in cls.__mro__[1:] for slot in base.__dict__.get("__slots__", ())}
+    cls_dict = dict(cls.__dict__)
+    names = tuple(f.name for f in fields(cls))
+    for name in names:
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    cls_dict["__slots__"] = tuple(name for name in names if name not in inherited)
+
+    def __reduce__(self: Any) -> Any:
+        # The variant is not reachable by its name, pickle it through the original class
+        return _new_slotted, (cls,), self.__getstate__()
+
+    cls_dict["__reduce__"] = __reduce__
+    slotted = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    slotted.__qualname__ = cls.__qualname__
+    return slotted
+
+
+def _new_slotted(cls: Any) -> Any:
+    """
+    Create an empty instance of the slotted variant of `cls`, used by pickle
+    """
+    slotted = cls.slotted()
+    return slotted.__new__(slotted)
+
+
+def _make_column(cc: Any) -> MutableSequence[Any]:
+    typecode = _COLUMN_TYPECODES.get(cc)
+    return [] if typecode is None else array(typecode)
+
+
+def invalidate_codecs(cls: Optional[type] = None) -> None:
+    """
+    Drop the compiled codecs of `cls`, or of all classes if `cls` is None.
+    Codecs are recompiled on first use, this is needed only if the
+    type hints of a class are changed after it has been (de)serialized.
+    """
+    caches: List[Dict[type, Any]] = [_decoders, _lazy_decoders, _encoders, _shallow_encoders]
+    for cache in caches:
+        if cls is None:
+            cache.clear()
+        else:
+            cache.pop(cls, None)
+
+
+T = TypeVar("T", bound="JSONSerializable")
 
 
 @dataclass
 class JSONSerializable:
     """
     Base class for JSON serializable dataclasses.
+
+    Subclasses can declare a tag, written to and read from the `json_tag_field`
+    key ("type" by default), to make Union fields dispatch on it:
+
+    @dataclass
+    class Circle(JSONSerializable, json_tag="circle"):
+        radius: float
     """
 
+    __slots__ = ()
+    __json_tag__: ClassVar[Optional[str]] = None
+    __json_tag_field__: ClassVar[str] = "type"
+
+    def __init_subclass__(
+        cls, json_tag: Optional[str] = None, json_tag_field: Optional[str] = None, **kwargs: Any
+    ) -> None:
+        super().__init_subclass__(**kwargs)
+        if json_tag is not None:
+            cls.__json_tag__ = json_tag
+        if json_tag_field is not None:
+            cls.__json_tag_field__ = json_tag_field
+
     def to_dict(self) -> Dict[str, Any]:
         """
         Convert an object to a dictionary.
+        The encoder of each class is compiled on first use and cached.
         """
-        ret: Dict[str, Any] = {}
-        for k, v in self.__dict__.items():
-            if isinstance(v, JSONSerializable):
-                ret[k] = v.to_dict()
-            elif isinstance(v, (list, set, tuple)):
-                ret[k] = [
-                    x.to_dict() if isinstance(x, JSONSerializable) else x for x in v  # type: ignore
-                ]
-            elif isinstance(v, dict):
-                ret[k] = {
-                    kk: vv.to_dict() if isinstance(vv, JSONSerializable) else vv
-                    for kk, vv in v.items()  # type: ignore
-                }
-            else:
-                ret[k] = v
-        return ret
+        cls = type(self)
+        try:
+            encoder = _encoders[cls]
+        except KeyError:
+            encoder = _encoders[cls] = _compile_encoder(cls)
+        return encoder(self)
 
-    @classmethod
-    def from_dict(cls, d: Dict[str, Any]) -> Self:
-        """
-        Create an object from a dictionary.
-        """
+    if not TYPE_CHECKING:
 
-        def _fit_to_type(cc: Any, v: Any) -> Any:
+        def __getattr__(self, name: str) -> Any:
             """
-            Helper function to convert a value v to a class type cc
+            Decode the fields of lazily decoded objects on first access
             """
-            cc_orig = get_origin(cc) or cc
+            if name.startswith("__"):
+                raise AttributeError(name)
+            pending = getattr(self, "__dict__", {}).get("_json_pending")
+            entry = None if pending is None else pending.get(name)
+            if entry is None:
+                raise AttributeError(
+                    f"'{type(self).__name__}' object has no attribute '{name}'"
+                )
+            conv, raw = entry
+            value = self.__dict__[name] = conv(raw)
+            # Drop the raw value, and the pending fields once all are decoded
+            pending.pop(name, None)  # type: ignore
+            if not pending:
+                self.__dict__.pop("_json_pending", None)
+            return value
 
-            # If the type is None or a primitive, return the value as is
-            if cc is None or cc_orig in {str, int, float, bool, Any}:
-                return v
+    def __getstate__(self) -> Any:
+        """
+        Return the state of the object for pickle and copy.
+        The pending fields of lazily decoded objects are decoded first,
+        as their converters cannot be pickled.
+        """
+        values = getattr(self, "__dict__", None)
+        if values is not None and "_json_pending" in values:
+            for name in list(values["_json_pending"]):
+                getattr(self, name)
+            # Fields assigned before being decoded are left in the pending fields
+            values.pop("_json_pending", None)
+        slots = {
+            name: getattr(self, name)
+            for cls in type(self).__mro__
+            for name in cls.__dict__.get("__slots__", ())
+            if hasattr(self, name)
+        }
+        return (values, slots) if slots else values
 
-            # If the type is a list or set, convert each element
-            if cc_orig in {list, set}:
-                element_class = get_args(cc)[0]
-                return [_fit_to_type(element_class, x) for x in v]
+    @classmethod
+    def slotted(cls: Type[T]) -> Type[T]:
+        """
+        Return a variant of this class storing its fields in __slots__,
+        which makes instances smaller. The variant is created once and cached.
+        Instances of the variant do not compare equal to instances of the original
+        class, and all the bases of the class must use __slots__ (as
+        JSONSerializable does) for the instances to have no __dict__.
+        """
+        try:
+            return _slotted[cls]
+        except KeyError:
+            slotted = _slotted[cls] = _make_slotted(cls)
+            return slotted  # type: ignore
 
-            # If the field is a tuple, convert each element
-            if cc_orig == tuple:
-                return tuple(
-                    _fit_to_type(element_class, x)
-                    for element_class, x in zip(get_args(cc), v)
-                )
+    @classmethod
+    def from_dicts(cls: Type[T], ds: Iterable[Dict[str, Any]]) -> "JSONBatch[T]":
+        """
+        Create a columnar batch of objects from dictionaries, see JSONBatch.
+        """
+        return JSONBatch(cls, ds)
 
-            # If the field is a dict, convert each element
-            if cc_orig == dict:
-                key_class, value_class = get_args(cc)
-                return {
-                    _fit_to_type(key_class, kk): _fit_to_type(value_class, vv)
-                    for kk, vv in v.items()
-                }
-
-            if cc_orig == Union:
-                # If the field is a Union, try each type until one works
-                for cc_child in get_args(cc):
-                    try:
-                        return _fit_to_type(cc_child, v)
-                    except Exception:  # pylint: disable=broad-except
-                        pass
-
-            # If the field is a JSONSerializable, convert it
-            if issubclass(cc_orig, JSONSerializable):
-                return cc.from_dict(v)
-
-            # Otherwise, raise an error
-            raise RuntimeError(f"Unknown type {cc}")
-
-        kwargs = {}
-        for k, v in d.items():
-            child_class = get_type_hints(cls).get(k, None)
-            kwargs[k] = _fit_to_type(child_class, v)
-        return cls(**kwargs)
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], lazy: bool = False) -> Self:
+        """
+        Create an object from a dictionary.
+        The decoder of each class is compiled on first use and cached.
+        If `lazy` is True, nested fields (e.g. lists, dicts and other
+        JSONSerializable objects) are only decoded on first access; untouched
+        fields are returned as they are by to_dict and to_json.
+        Fields with a plain default value and classes with a __post_init__
+        are always decoded eagerly.
+        """
+        decoders = _lazy_decoders if lazy else _decoders
+        try:
+            decoder = decoders[cls]
+        except KeyError:
+            compile_decoder = _compile_lazy_decoder if lazy else _compile_decoder
+            decoder = decoders[cls] = compile_decoder(cls)
+        return decoder(d)
 
     def to_json(self) -> str:
         """
         Convert an object to a JSON string.
         """
-        return json.dumps(self.to_dict())
+        return _json_encoder.encode(self)
+
+    def write_json(self, fp: IO[Any]) -> None:
+        """
+        Write an object as JSON to the text or binary file object `fp`.
+        The output is written in chunks, without building the whole string first.
+        """
+        binary = _is_binary(fp)
+        chunks: List[str] = []
+        size = 0
+        for chunk in _json_encoder.iterencode(self):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= _WRITE_CHUNK_SIZE:
+                data = "".join(chunks)
+                fp.write(data.encode("utf-8") if binary else data)
+                chunks.clear()
+                size = 0
+        data = "".join(chunks)
+        fp.write(data.encode("utf-8") if binary else data)
+
+    @classmethod
+    def from_json(cls, s: JSONSource, lazy: bool = False) -> Self:
+        """
+        Create an object from a JSON document, which can be a string, a bytes-like
+        object (bytes, bytearray, memoryview), a path or a file object.
+        Files are memory-mapped when possible, and bytes-like objects are
+        passed to the parser without copies when it supports them (see set_json_parser).
+        See from_dict for the `lazy` parameter.
+        """
+        return cls.from_dict(_parse(s), lazy)
 
     @classmethod
-    def from_json(cls, s: str) -> Self:
+    def iter_from_json_lines(cls: Type[T], fp: IO[Any]) -> Iterator[T]:
         """
-        Create an object from a JSON string.
+        Lazily create objects from a text or binary file object with one
+        JSON document per line (NDJSON). Blank lines are skipped.
         """
-        return cls.from_dict(json.loads(s))
+        for line in fp:
+            if line.strip():
+                yield cls.from_dict(_Parser.loads(line))
+
+    @classmethod
+    def iter_from_json_array(
+        cls: Type[T], fp: IO[Any], chunk_size: int = _READ_CHUNK_SIZE
+    ) -> Iterator[T]:
+        """
+        Lazily create objects from a text or binary file object containing
+        a top-level JSON array. The file is read in chunks of `chunk_size`.
+        """
+        for d in _iter_json_array(fp, chunk_size):
+            yield cls.from_dict(d)
+
+
+class JSONBatch(Generic[T]):
+    """
+    Columnar container for many objects of the same JSONSerializable class.
+    Each field is stored in its own column, using compact arrays for int and
+    float fields, and objects are only created when rows are accessed:
+
+    batch = Point.from_dicts(dicts)
+    batch.column("x")  # array('d', [...])
+    batch[0]  # Point(x=..., y=...)
+    """
+
+    def __init__(self, cls: Type[T], ds: Iterable[Dict[str, Any]] = ()):
+        """
+        cls: the JSONSerializable class of the rows
+        ds: dictionaries to decode into the batch
+        """
+        self.cls = cls
+        hints = get_type_hints(cls)
+        self._fields = fields(cls)
+        self._columns: Dict[str, MutableSequence[Any]] = {
+            f.name: _make_column(hints.get(f.name, Any)) for f in self._fields
+        }
+        self._convs = {f.name: _compile_converter(hints.get(f.name, Any)) for f in self._fields}
+        self._length = 0
+        self.extend(ds)
+
+    def extend(self, ds: Iterable[Dict[str, Any]]) -> None:
+        """
+        Decode dictionaries and append them to the batch.
+        Dictionaries are decoded column by column, in chunks of _BATCH_CHUNK_SIZE.
+        """
+        it = iter(ds)
+        while True:
+            rows = list(islice(it, _BATCH_CHUNK_SIZE))
+            if not rows:
+                return
+            self._extend_rows(rows)
+
+    def _extend_rows(self, rows: List[Dict[str, Any]]) -> None:
+        tag = _get_extra_tag(self.cls)
+        allowed = set(self._columns) | ({tag[0]} if tag is not None else set())
+        for d in rows:
+            if not d.keys() <= allowed:
+                extra = sorted(set(d) - allowed)
+                raise TypeError(f"{self.cls.__name__} got unexpected fields {extra}")
+
+        # Decode all the columns before appending them, so that errors leave the batch untouched
+        new_columns: List[List[Any]] = []
+        for f in self._fields:
+            try:
+                values = list(map(itemgetter(f.name), rows))
+            except KeyError:
+                values = [self._get_value(d, f) for d in rows]
+            conv = self._convs[f.name]
+            new_columns.append(values if conv is None else list(map(conv, values)))
+
+        for f, values in zip(self._fields, new_columns):
+            column = self._columns[f.name]
+            size = len(column)
+            try:
+                column.extend(values)
+            except (TypeError, OverflowError):
+                # The values do not fit in the array, fallback to a list
+                del column[size:]
+                self._columns[f.name] = list(column) + values
+        self._length += len(rows)
+
+    def _get_value(self, d: Dict[str, Any], f: "Field[Any]") -> Any:
+        if f.name in d:
+            return d[f.name]
+        if f.default is not MISSING:
+            return f.default
+        if f.default_factory is not MISSING:
+            return f.default_factory()
+        raise TypeError(f"{self.cls.__name__} missing required field '{f.name}'")
+
+    def column(self, name: str) -> MutableSequence[Any]:
+        """
+        Return the column of the field `name`
+        """
+        return self._columns[name]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, i: int) -> T:
+        if not isinstance(i, int):
+            raise TypeError(
+                f"JSONBatch indices must be integers, not {type(i).__name__}"
+                " (use itertools.islice to iterate over a range of rows)"
+            )
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("JSONBatch index out of range")
+        return self.cls(**{name: column[i] for name, column in self._columns.items()})
+
+    def __iter__(self) -> Iterator[T]:
+        names = list(self._columns)
+        if not names:
+            yield from (self.cls() for _ in range(self._length))
+            return
+        for row in zip(*self._columns.values()):
+            yield self.cls(**dict(zip(names, row)))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """
+        Convert all the rows to dictionaries
+        """
+        return [row.to_dict() for row in self]
+
+
+def write_json_lines(
+    objs: Iterable[JSONSerializable], fp: IO[Any], buffer_size: int = _WRITE_CHUNK_SIZE
+) -> int:
+    """
+    Write the objects `objs` as JSON lines (NDJSON) to the text or binary file object `fp`.
+    Lines are buffered and written in batches of about `buffer_size` characters.
+    Returns the number of objects written.
+    """
+    binary = _is_binary(fp)
+    lines: List[str] = []
+    size = 0
+    count = 0
+    for obj in objs:
+        line = _json_encoder.encode(obj)
+        lines.append(line)
+        size += len(line) + 1
+        count += 1
+        if size >= buffer_size:
+            data = "\n".join(lines) + "\n"
+            fp.write(data.encode("utf-8") if binary else data)
+            lines.clear()
+            size = 0
+    if lines:
+        data = "\n".join(lines) + "\n"
+        fp.write(data.encode("utf-8") if binary else data)
+    return count
+
+
+def dumps(obj: Any) -> str:
+    """
+    Convert `obj` to a JSON string. Unlike json.dumps, JSONSerializable objects
+    and sets can appear anywhere in `obj`, e.g. in the values of a dict.
+    """
+    return _json_encoder.encode(obj)
@@ -2,38 +2,270 @@
 Utilities for logging
 """
 import logging
-from typing import Optional, Generator, Union, TextIO
+from typing import Optional, Generator, Union, TextIO, List, Dict, Tuple, Any
 import os
+import queue
 import sys
+import threading
+import weakref
 from contextlib import contextmanager
 from functools import lru_cache
 
 
+class BackgroundStreamHandler(logging.Handler):
+    """
+    Handler writing records to a stream from a background thread, so that logging
+    calls don't wait for formatting and writing.
+    Records are put in a queue of at most `queue_size` records: when it is full,
+    records are dropped (and the number of dropped records is logged) unless `block`
+    is True, then logging calls wait for the writer.
+    The writer formats the records and writes up to `batch_size` of them at once.
+    As records are formatted later, the arguments of logging calls should not be
+    modified after the call.
+    Use flush() to wait until all queued records are written.
+    """
+
+    terminator = "\n"
+
+    def __init__(
+        self,
+        stream: TextIO = sys.stderr,
+        queue_size: int = 10_000,
+        block: bool = False,
+        batch_size: int = 1024,
+    ):
+        super().__init__()
+        self.stream = stream
+        self.queue_size = queue_size
+        self.block = block
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._start()
+        _background_handlers.add(self)
+
+    def _start(self) -> None:
+        self._queue: "queue.Queue[Optional[logging.LogRecord]]" = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(
+            target=self._write_records, name="frittomisto-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._queue.put(record, block=self.block)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        _background_handlers.discard(self)
+        super().close()
+
+    def _write_records(self) -> None:
+        reported = 0
+        while True:
+            records: List[Optional[logging.LogRecord]] = [self._queue.get()]
+            try:
+                while len(records) < self.batch_size:
+                    records.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            if self.dropped != reported:
+                lines.append(f"{self.dropped - reported} log records dropped{self.terminator}")
+                reported = self.dropped
+            for record in records:
+                if record is not None:
+                    try:
+                        lines.append(self.format(record) + self.terminator)
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        self.handleError(record)
+            try:
+                if lines:
+                    self.stream.write("".join(lines))
+                    self.stream.flush()
+            except Exception:  # pylint: disable=broad-exception-caught
+                if records[0] is not None:
+                    self.handleError(records[0])
+            for _ in records:
+                self._queue.task_done()
+            if None in records:
+                return
+
+
+_background_handlers: "weakref.WeakSet[BackgroundStreamHandler]" = weakref.WeakSet()
+
+
+def _restart_background_handlers() -> None:
+    # The writer threads are not running in the child process, queued records
+    # are written by the parent
+    for handler in _background_handlers:
+        handler._start()  # pylint: disable=protected-access
+
+
+os.register_at_fork(after_in_child=_restart_background_handlers)
+
+
+# Attributes of all log records, the others are extra fields (e.g. log.info(msg, extra={...}))
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formatter writing records as JSON lines, with the time, pid, logger name, level,
+    message and extra fields of each record.
+    Messages which are not strings (e.g. JSONSerializable objects or dicts) and extra
+    fields are written as JSON values. They are serialized only when the record
+    is emitted, so they should not be modified after the logging call.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # pylint: disable=import-outside-toplevel
+        from frittomisto.json import dumps
+
+        self._dumps = dumps
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": record.created,
+            "pid": record.process,
+            "name": record.name,
+            "level": record.levelname,
+        }
+        if isinstance(record.msg, str) or record.args:
+            entry["message"] = record.getMessage()
+        else:
+            entry["message"] = record.msg
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        try:
+            return self._dumps(entry)
+        except TypeError:
+            # Values which are not JSON serializable are written as their repr
+            return self._dumps(
+                {k: v if isinstance(v, _JSON_TYPES) else repr(v) for k, v in entry.items()}
+            )
+
+
+class _TextFormatter(logging.Formatter):
+    """
+    Text formatter adding the number of records suppressed by a SamplingFilter
+    """
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        text = super().formatMessage(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar records suppressed)"
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Filter limiting the number of records logged by each call site (i.e. line of code),
+    to keep logging calls in hot loops: only 1 record in `every` passes, and at most
+    `per_second` records per second if set.
+    The next record passing after some were filtered out has a `suppressed`
+    attribute with their number, which the formatters of get_logger write.
+    """
+
+    def __init__(self, every: int = 1, per_second: Optional[int] = None):
+        super().__init__()
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        if per_second is not None and per_second < 1:
+            raise ValueError("per_second must be at least 1")
+        self.every = every
+        self.per_second = per_second
+        # Per call site: [calls, start of the current second, passed in it, suppressed]
+        self._sites: Dict[Tuple[str, int], List[Any]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [0, 0.0, 0, 0]
+        site[0] += 1
+        keep = (site[0] - 1) % self.every == 0
+        if keep and self.per_second is not None:
+            if record.created - site[1] >= 1.0:
+                site[1] = record.created
+                site[2] = 0
+            keep = site[2] < self.per_second
+            site[2] += keep
+        if not keep:
+            site[3] += 1
+            return False
+        if site[3]:
+            record.suppressed = site[3]
+            site[3] = 0
+        return True
+
+
 @lru_cache(
     maxsize=None
 )  # Cache the result to avoid registering the same handler multiple times
-def get_logger(
-    name: Optional[str] = None, stream: TextIO = sys.stderr
+def get_logger(  # pylint: disable=too-many-arguments
+    name: Optional[str] = None,
+    stream: TextIO = sys.stderr,
+    *,
+    background: bool = False,
+    queue_size: int = 10_000,
+    block: bool = False,
+    structured: bool = False,
+    sample_every: int = 1,
+    sample_per_second: Optional[int] = None,
 ) -> logging.Logger:
     """
     Returns a logger with the given name.
     Set the level of the logger with logger.setLevel(logging.DEBUG)
+    With background=True, records are written by a background thread,
+    see BackgroundStreamHandler for queue_size and block.
+    With structured=True, records are written as JSON lines, see JSONFormatter.
+    With sample_every or sample_per_second, the records of each line of code
+    are sampled, see SamplingFilter.
     """
     pid = os.getpid()
+    formatter: logging.Formatter
     if name is None:
         logger = logging.getLogger()
-        formatter = logging.Formatter(
+        formatter = _TextFormatter(
             f"{pid}: %(asctime)s - %(levelname)s - %(message)s"
         )
     else:
         logger = logging.getLogger(name)
-        formatter = logging.Formatter(
+        formatter = _TextFormatter(
             f"{pid}: %(asctime)s - %(name)s - %(levelname)s - %(message)s"
         )
+    if structured:
+        formatter = JSONFormatter()
 
-    stream_handler = logging.StreamHandler(stream=stream)
+    stream_handler: logging.Handler
+    if background:
+        stream_handler = BackgroundStreamHandler(stream, queue_size=queue_size, block=block)
+    else:
+        stream_handler = logging.StreamHandler(stream=stream)
     stream_handler.setFormatter(formatter)
     logger.addHandler(stream_handler)
+    if sample_every > 1 or sample_per_second is not None:
+        logger.addFilter(SamplingFilter(sample_every, sample_per_second))
     logger.propagate = False
     return logger
 
@@ -1,68 +1,486 @@
 """
 Perf measuring utilities
 """
+# pylint: disable=too-many-lines
 import time
 import os
 import fcntl
-from typing import Dict, Optional, List, Union
+import json
+import math
+import signal
+import struct
+import sys
+import threading
+import atexit
+import warnings
+from contextvars import ContextVar
+from functools import wraps
+from types import CodeType, FrameType
+from typing import (
+    Any, Callable, ClassVar, Dict, Optional, List, Set, Tuple, TypeVar, Union, TextIO, Iterator
+)
+import itertools
 from itertools import chain
 
+_F = TypeVar("_F", bound=Callable[..., Any])
 
-class _PP:
+# Each power of two is split in 2**_HIST_SUB_BITS buckets, i.e. a relative error of ~3%
+_HIST_SUB_BITS = 4
+_HIST_SUB_BUCKETS = 1 << _HIST_SUB_BITS
+# Enough buckets for any duration fitting in 64 bits of nanoseconds
+_HIST_BUCKETS = 64 * _HIST_SUB_BUCKETS
+
+
+class _Histogram:
+    """
+    Fixed-memory histogram of durations, with log-scaled buckets (HDR style).
+    Durations are recorded in nanoseconds: values below 2 * _HIST_SUB_BUCKETS
+    have their own bucket, above that each power of two is split
+    in _HIST_SUB_BUCKETS buckets of equal width.
+    """
+
+    def __init__(self):
+        self.counts: List[int] = [0] * _HIST_BUCKETS
+
+    def record(self, value: float, count: int = 1) -> None:
+        """
+        Record a duration `value` (in seconds) `count` times
+        """
+        self.counts[_bucket_index(value)] += count
+
+    def merge(self, other: "_Histogram") -> None:
+        """
+        Add the counts of `other` to this histogram
+        """
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def percentile(self, p: float) -> float:
+        """
+        Return the `p`-th percentile (0 <= p <= 100) of the recorded durations
+        in seconds, i.e. the middle of the bucket containing it.
+        Returns 0 if no durations were recorded.
+        """
+        total = sum(self.counts)
+        if total == 0:
+            return 0
+        target = max(1, p / 100 * total)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                low, high = _bucket_bounds(index)
+                return (low + high) / 2 / 1e9
+        raise AssertionError("unreachable")
+
+
+def _bucket_index(value: float) -> int:
+    """
+    Return the index of the bucket of the duration `value` (in seconds)
+    """
+    ns = int(value * 1e9)
+    if ns < 2 * _HIST_SUB_BUCKETS:
+        return ns if ns > 0 else 0
+    shift = ns.bit_length() - _HIST_SUB_BITS - 1
+    index = (shift << _HIST_SUB_BITS) + (ns >> shift)
+    return index if index < _HIST_BUCKETS else _HIST_BUCKETS - 1
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """
+    Return the range [low, high) of nanoseconds covered by bucket `index`
+    """
+    if index < 2 * _HIST_SUB_BUCKETS:
+        return index, index + 1
+    shift = (index >> _HIST_SUB_BITS) - 1
+    mantissa = index - (shift << _HIST_SUB_BITS)
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class _PP:  # pylint: disable=too-many-instance-attributes
     def __init__(self, name: str):
         """
         name: name of the profiler
         """
         self.name: str = name
         self.tot_time: float = 0
+        # Sum of the squared times, for the variance of the measures
+        self.sq_time: float = 0
+        # Time not spent in nested perf counters
+        self.self_time: float = 0
         self.rounds: int = 0
-        self.started: Optional[float] = None
         self.max_time = 0
+        self.hist = _Histogram()
+        # Memory allocated by the rounds, see pp_track_memory
+        self.mem_rounds: int = 0
+        self.mem_net: int = 0
+        self.mem_peak: int = 0
+        # Set when the counter is removed by pp_reset, so that bound users can replace it
+        self.detached = False
 
-    def start(self, allow_restart: bool = False) -> None:
+    def record(self, runtime: float, weight: int = 1) -> None:
         """
-        Starts the perf counter
+        Record a measure of `runtime` seconds.
+        A measure sampled once every N rounds is recorded with weight N,
+        so that totals and percentiles estimate all the rounds.
         """
-        if not allow_restart and self.started is not None:
-            raise RuntimeError("Already started")
-        self.started = time.perf_counter()
+        self.max_time = max(self.max_time, runtime)
+        self.tot_time += runtime * weight
+        self.sq_time += runtime * runtime * weight
+        self.rounds += weight
+        self.hist.record(runtime, weight)
 
-    def stop(self, stop_time: float) -> None:
+    def record_memory(self, net: int, peak: int, weight: int = 1) -> None:
         """
-        Stops the perf counter, trowhs an error if it was not started.
-        Note: `stop_time` is the time returned by `time.perf_counter()`,
-        this value is passed as parameter to avoid overhead.
+        Record a round which allocated `net` bytes, peaking at `peak` bytes
         """
-        if self.started is None:
-            raise RuntimeError("Not started")
-        runtime = stop_time - self.started
-        self.max_time = max(self.max_time, runtime)
-        self.tot_time += runtime
-        self.rounds += 1
-        self.started = None
+        self.mem_rounds += weight
+        self.mem_net += net * weight
+        self.mem_peak = max(self.mem_peak, peak)
 
-    def stop_if_started(self, stop_time: float) -> None:
+    def percentile(self, p: float) -> float:
         """
-        Stops the perf counter if it was started
+        Return the `p`-th percentile (0 <= p <= 100) of the measured times,
+        e.g. percentile(99) for the p99 latency.
+        The result has a relative error of a few percents and never exceeds max_time.
         """
-        if self.started is None:
-            return
-        self.stop(stop_time)
+        return min(self.hist.percentile(p), self.max_time)
+
+    def variance(self) -> float:
+        """
+        Return the variance of the measured times
+        """
+        if self.rounds < 2:
+            return 0
+        mean = self.tot_time / self.rounds
+        return max(0, (self.sq_time - mean * self.tot_time) / (self.rounds - 1))
+
+    def merge(self, other: "_PP") -> None:
+        """
+        Add the measures of `other` (e.g. from another process) to this counter
+        """
+        self.tot_time += other.tot_time
+        self.sq_time += other.sq_time
+        self.self_time += other.self_time
+        self.rounds += other.rounds
+        self.max_time = max(self.max_time, other.max_time)
+        self.hist.merge(other.hist)
+        self.mem_rounds += other.mem_rounds
+        self.mem_net += other.mem_net
+        self.mem_peak = max(self.mem_peak, other.mem_peak)
+
+    def to_state(self) -> Dict[str, Any]:
+        """
+        Return the measures of the counter as a JSON serializable dict
+        """
+        return {
+            "tot_time": self.tot_time,
+            "sq_time": self.sq_time,
+            "self_time": self.self_time,
+            "rounds": self.rounds,
+            "max_time": self.max_time,
+            "hist": {i: c for i, c in enumerate(self.hist.counts) if c},
+            "mem_rounds": self.mem_rounds,
+            "mem_net": self.mem_net,
+            "mem_peak": self.mem_peak,
+        }
+
+    @classmethod
+    def from_state(cls, name: str, state: Dict[str, Any]) -> "_PP":
+        """
+        Create a counter from the measures returned by to_state
+        """
+        pp = cls(name)
+        pp.tot_time = state["tot_time"]
+        pp.sq_time = state.get("sq_time", 0)
+        pp.self_time = state["self_time"]
+        pp.rounds = state["rounds"]
+        pp.max_time = state["max_time"]
+        for i, c in state["hist"].items():
+            pp.hist.counts[int(i)] = c
+        pp.mem_rounds = state.get("mem_rounds", 0)
+        pp.mem_net = state.get("mem_net", 0)
+        pp.mem_peak = state.get("mem_peak", 0)
+        return pp
+
+
+class _Node(_PP):
+    """
+    A perf counter of the call tree, measuring the calls of a path of counters
+    """
+
+    def __init__(self, path: Tuple[str, ...]):
+        super().__init__(path[-1])
+        self.path = path
+        self.children: Dict[str, "_Node"] = {}
 
 
 __pp__: Dict[str, _PP] = {}
 
+# Call tree of the perf counters, indexed by the path of names from the root
+__pp_tree__: Dict[Tuple[str, ...], _Node] = {}
+# Roots of the call tree, the other nodes are found from their parent node
+_tree_roots: Dict[str, _Node] = {}
+
+
+class _Tree:
+    """
+    Whether the measures are also aggregated in the call tree, see pp_tree
+    """
+
+    enabled = False
+
+
+def _get_pp(name: str) -> _PP:
+    """
+    Return the perf counter named `name`, creating it if needed
+    """
+    pp = __pp__.get(name)
+    if pp is None:
+        pp = __pp__[name] = _PP(name)
+    return pp
+
+
+def _get_node(parent: Optional[_Node], name: str) -> _Node:
+    """
+    Return the child `name` of the node `parent` of the call tree (a root if
+    `parent` is None), creating it if needed
+    """
+    if parent is not None and parent.detached:
+        parent = _get_path_node(parent.path)
+    children = _tree_roots if parent is None else parent.children
+    node = children.get(name)
+    if node is None:
+        path = (name,) if parent is None else parent.path + (name,)
+        node = children[name] = __pp_tree__[path] = _Node(path)
+    return node
+
+
+def _get_path_node(path: Tuple[str, ...]) -> _Node:
+    """
+    Return the node of the call tree measuring `path`, creating it if needed
+    """
+    node = None
+    for name in path:
+        node = _get_node(node, name)
+    return node  # type: ignore
+
+
+class _Span:  # pylint: disable=too-many-instance-attributes
+    """
+    A running measure of a perf counter, see _push_span
+    """
+
+    __slots__ = (
+        "parent", "owner", "task", "pp", "node", "start", "child_time", "skipped",
+        "stopped", "mem_start", "mem_peak",
+    )
+
+    def __init__(self, pp: _PP, parent: Optional["_Span"], owner: Any, task: Any):
+        self.parent = parent
+        # The section or decorator which started the span, None for pp_start
+        self.owner = owner
+        # The thread or asyncio task which started the span, only set for pp_start
+        self.task = task
+        self.pp = pp
+        # The node of the call tree, None unless the call tree is enabled
+        self.node: Optional[_Node] = _span_node(parent, pp.name) if _Tree.enabled else None
+        self.child_time: float = 0
+        # Number of nested rounds of the owner which were not sampled
+        self.skipped = 0
+        # Set when the span is stopped while spans started after it are still running
+        self.stopped = False
+        # Traced memory at the start of the span, and highest traced memory seen
+        # since then, None if the memory of the counter is not tracked
+        self.mem_start: Optional[int] = None
+        self.mem_peak = 0
+        self.start = time.perf_counter()
+
+
+def _span_node(parent: Optional[_Span], name: str) -> _Node:
+    """
+    Return the node of the call tree of a span of the counter `name` started in `parent`
+    """
+    if parent is None:
+        return _tree_roots.get(name) or _get_node(None, name)
+    node = parent.node
+    if node is None:
+        # The parent was started before the call tree was enabled
+        node = _get_path_node(_span_path(parent))
+    return node.children.get(name) or _get_node(node, name)
+
+
+def _span_path(span: _Span) -> Tuple[str, ...]:
+    """
+    Return the path of names of the running span `span` from the root
+    """
+    if span.node is not None:
+        return span.node.path
+    path = []
+    while span is not None:
+        path.append(span.pp.name)
+        span = span.parent  # type: ignore
+    return tuple(reversed(path))
+
+
+# A traced measure: start time, runtime, self time, thread id and call path
+_TraceEvent = Tuple[float, float, float, int, Tuple[str, ...]]
+
+
+class _Trace:
+    """
+    Ring buffer of the last traced measures, see pp_trace.
+    The buffer is preallocated and each measure takes its slot from an atomic
+    counter, so recording is lock-free.
+    """
+
+    events: ClassVar[Optional[List[Optional[_TraceEvent]]]] = None
+    index: ClassVar[Iterator[int]] = itertools.count()
+
+
+class _Memory:
+    """
+    Counters whose memory is tracked, see pp_track_memory
+    """
+
+    names: Set[str] = set()
+    # Whether tracemalloc was started by pp_track_memory
+    tracing = False
+
+
+# Functions of tracemalloc, which is only imported when tracking memory.
+# Python < 3.9 cannot reset the peak, so peaks are only exact when they are new highs
+_get_traced_memory: Callable[[], Tuple[int, int]] = lambda: (0, 0)
+_reset_peak: Optional[Callable[[], None]] = None
+
+
+def _start_memory(span: _Span) -> None:
+    current, peak = _get_traced_memory()
+    if _reset_peak is not None:
+        # Resetting the peak hides it from the running spans, save it in them
+        parent = span.parent
+        while parent is not None:
+            if parent.mem_start is not None:
+                parent.mem_peak = max(parent.mem_peak, peak)
+            parent = parent.parent
+        _reset_peak()
+    span.mem_start = span.mem_peak = current
+
+
+# Top of the stack of the running spans, each span links to the span below it.
+# Each thread and asyncio task has its own stack: spans started by a task are
+# nested under the spans running when it was created
+_spans: ContextVar[Optional[_Span]] = ContextVar("frittomisto_pp_spans", default=None)
+
+
+def _current_task() -> Any:
+    """
+    Return the running asyncio task, or the id of the current thread outside of tasks
+    """
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is not None:
+        loop = asyncio._get_running_loop()  # pylint: disable=protected-access
+        if loop is not None:
+            task = asyncio.current_task(loop)
+            if task is not None:
+                return task
+    return threading.get_ident()
+
+
+def _push_span(pp: _PP, parent: Optional[_Span], owner: Any = None, task: Any = None) -> _Span:
+    """
+    Start a span of the perf counter `pp` in the current thread/task,
+    on top of the running span `parent`
+    """
+    span = _Span(pp, parent, owner, task)
+    if _Memory.names and pp.name in _Memory.names:
+        _start_memory(span)
+        span.start = time.perf_counter()
+    _spans.set(span)
+    return span
+
+
+def _pop_span(span: _Span, stop_time: float, weight: int = 1) -> None:
+    """
+    Stop the span `span`, recording its measure in its perf counter and in the call tree
+    """
+    span.stopped = True
+    if _spans.get() is span:
+        top = span.parent
+        while top is not None and top.stopped:
+            top = top.parent
+        _spans.set(top)
+
+    runtime = stop_time - span.start
+    if span.parent is not None:
+        span.parent.child_time += runtime
+    self_time = runtime - span.child_time if runtime > span.child_time else 0
+
+    pp = span.pp
+    if pp.detached:
+        pp = _get_pp(pp.name)
+    # Same as pp.record, inlined as this is the hot path
+    total = runtime * weight
+    pp.max_time = max(pp.max_time, runtime)
+    pp.tot_time += total
+    pp.sq_time += runtime * total
+    pp.self_time += self_time * weight
+    pp.rounds += weight
+    pp.hist.counts[_bucket_index(runtime)] += weight
+    node = span.node
+    if node is not None:
+        if node.detached:
+            node = _get_path_node(node.path)
+        node.record(runtime, weight)
+        node.self_time += self_time * weight
+
+    if span.mem_start is not None:
+        current, peak = _get_traced_memory()
+        peak = max(span.mem_peak, peak) - span.mem_start
+        pp.record_memory(current - span.mem_start, peak, weight)
+        if node is not None:
+            node.record_memory(current - span.mem_start, peak, weight)
+
+    events = _Trace.events
+    if events is not None:
+        events[next(_Trace.index) % len(events)] = (
+            span.start,
+            runtime,
+            self_time,
+            threading.get_ident(),
+            _span_path(span),
+        )
+
+
+def _find_started(name: str, task: Any, span: Optional[_Span]) -> Optional[_Span]:
+    """
+    Return the running span started by pp_start(name) in the thread/task `task`,
+    looking from the span `span` down
+    """
+    while span is not None:
+        if span.task == task and span.pp.name == name and not span.stopped:
+            return span
+        span = span.parent
+    return None
+
 
 def pp_start(name: str, allow_restart: bool = False):
     """
     Start a perf counter named `name`.
     If allow_restart is True, the perf counter can be started multiple times,
     in which case only the last start time is considered.
+    Perf counters are started and stopped independently in each thread and asyncio
+    task, and the counters started while another one runs are nested under it.
     """
-    if name not in __pp__:
-        __pp__[name] = _PP(name)
+    task = _current_task()
+    top = _spans.get()
+    span = None if top is None else _find_started(name, task, top)
+    if span is not None:
+        if not allow_restart:
+            raise RuntimeError("Already started")
+        span.start = time.perf_counter()
+        return
     # Start the perf counter as last as possible to avoid overhead
-    __pp__[name].start(allow_restart)
+    _push_span(__pp__.get(name) or _get_pp(name), top, None, task)
 
 
 def pp_stop(name: str, allow_restop: bool = False):
@@ -73,12 +491,13 @@ def pp_stop(name: str, allow_restop: bool = False):
     """
     # Stop the perf counter as soon as possible to avoid overhead
     stop_time = time.perf_counter()
-    if name not in __pp__:
-        __pp__[name] = _PP(name)
+    span = _find_started(name, _current_task(), _spans.get())
+    if span is not None:
+        _pop_span(span, stop_time)
+        return
     if not allow_restop:
-        __pp__[name].stop(stop_time)
-    else:
-        __pp__[name].stop_if_started(stop_time)
+        raise RuntimeError("Not started")
+    _get_pp(name)
 
 def pp_get(name: str) -> _PP:
     """
@@ -86,19 +505,680 @@ def pp_get(name: str) -> _PP:
     """
     return __pp__[name]
 
+
+# Event counters, see pp_count
+__pp_counts__: Dict[str, int] = {}
+
+
+def pp_count(name: str, n: int = 1) -> None:
+    """
+    Add `n` to the event counter named `name`, e.g. to count cache hits.
+    Event counters are printed by pp_stats.
+    """
+    __pp_counts__[name] = __pp_counts__.get(name, 0) + n
+
+
+def pp_get_count(name: str) -> int:
+    """
+    Return the value of the event counter named `name`, 0 if it was never incremented
+    """
+    return __pp_counts__.get(name, 0)
+
+
 def pp_reset(name: Optional[str] = None) -> None:
     """
-    Reset the perf counter named `name`.
-    If `name` is None, reset all perf counters.
+    Reset the perf counter or event counter named `name`.
+    If `name` is None, reset all perf counters and event counters.
     """
     if name is None:
+        for pp in chain(__pp__.values(), __pp_tree__.values()):
+            pp.detached = True
         __pp__.clear()
+        __pp_tree__.clear()
+        _tree_roots.clear()
+        __pp_counts__.clear()
+    elif name in __pp_counts__ and name not in __pp__:
+        del __pp_counts__[name]
     else:
-        del __pp__[name]
+        __pp__.pop(name).detached = True
+        for path in [path for path in __pp_tree__ if name in path]:
+            __pp_tree__.pop(path).detached = True
+            if len(path) == 1:
+                del _tree_roots[name]
+            elif path[:-1] in __pp_tree__:
+                del __pp_tree__[path[:-1]].children[path[-1]]
 
-def pp_stats():
-    """ 
-    Pretty print perf counters stats
+
+def pp_tree(enabled: bool = True) -> None:
+    """
+    Also aggregate the measures in the call tree of the perf counters, which
+    pp_stats(tree=True) prints. The tree is disabled by default as it doubles
+    the cost of recording a measure. The rounds already running when the tree
+    is enabled are not added to it.
+    """
+    _Tree.enabled = enabled
+
+
+def pp_trace(size: Optional[int] = 1 << 16) -> None:
+    """
+    Record the last `size` measures of all perf counters, with their start time,
+    so that they can be exported with pp_trace_chrome or pp_trace_collapsed.
+    The measures recorded so far are dropped. If `size` is None, stop tracing.
+    """
+    if size is None:
+        _Trace.events = None
+    else:
+        events: List[Optional[_TraceEvent]] = [None] * size
+        _Trace.events = events
+    _Trace.index = itertools.count()
+
+
+def _trace_events() -> List[_TraceEvent]:
+    """
+    Return the traced measures, ordered by start time
+    """
+    if _Trace.events is None:
+        raise RuntimeError("Perf counters are not traced, call pp_trace first")
+    return sorted(e for e in list(_Trace.events) if e is not None)
+
+
+def pp_trace_chrome(fp: TextIO) -> None:
+    """
+    Write the traced measures to `fp` in the Chrome trace event format,
+    which can be opened with chrome://tracing or https://ui.perfetto.dev
+    """
+    pid = os.getpid()
+    events = [
+        {
+            "name": path[-1],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": runtime * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": {"path": ";".join(path), "self_time": self_time},
+        }
+        for start, runtime, self_time, tid, path in _trace_events()
+    ]
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+def pp_trace_collapsed(fp: TextIO) -> None:
+    """
+    Write the traced measures to `fp` as collapsed stacks (one "a;b;c <self time in us>"
+    line per call path), the input format of flamegraph tools.
+    """
+    stacks: Dict[Tuple[str, ...], float] = {}
+    for _, _, self_time, _, path in _trace_events():
+        stacks[path] = stacks.get(path, 0) + self_time
+    for path, self_time in stacks.items():
+        fp.write(f"{';'.join(path)} {round(self_time * 1e6)}\n")
+
+
+def pp_track_memory(*names: str) -> None:
+    """
+    Also measure the memory allocated by each round of the perf counters `names`:
+    the net bytes allocated between start and stop, and the peak of the allocated
+    bytes. pp_stats reports the average net bytes per round and the highest peak.
+    Memory is measured with tracemalloc, which is started if needed and slows
+    down allocations while tracking. Allocations of other threads running at
+    the same time are counted too.
+    """
+    global _get_traced_memory, _reset_peak  # pylint: disable=global-statement
+    import tracemalloc  # pylint: disable=import-outside-toplevel
+
+    _get_traced_memory = tracemalloc.get_traced_memory
+    _reset_peak = getattr(tracemalloc, "reset_peak", None)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _Memory.tracing = True
+    _Memory.names.update(names)
+
+
+def pp_untrack_memory(*names: str) -> None:
+    """
+    Stop measuring the memory allocated by the perf counters `names`, or by all
+    the perf counters if no name is given, see pp_track_memory
+    """
+    if names:
+        _Memory.names.difference_update(names)
+    else:
+        _Memory.names.clear()
+    if not _Memory.names and _Memory.tracing:
+        import tracemalloc  # pylint: disable=import-outside-toplevel
+
+        tracemalloc.stop()
+        _Memory.tracing = False
+
+
+class _PPSection:
+    """
+    Context manager measuring a section of code, see pp_section
+    """
+
+    __slots__ = ("name", "sample_rate", "_countdown", "_pp")
+
+    def __init__(self, name: str, sample_rate: int = 1, memory: bool = False):
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be at least 1")
+        self.name = name
+        self.sample_rate = sample_rate
+        self._countdown = sample_rate
+        self._pp = _get_pp(name)
+        if memory:
+            pp_track_memory(name)
+
+    def __enter__(self) -> "_PPSection":
+        self._countdown -= 1
+        if not self._countdown:
+            self._countdown = self.sample_rate
+            pp = self._pp
+            if pp.detached:
+                pp = self._pp = _get_pp(self.name)
+            _push_span(pp, _spans.get(), self)
+            return self
+        # Not sampled, remember it if nested in a sampled round of this section
+        span = self._find_span()
+        if span is not None:
+            span.skipped += 1
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        stop_time = time.perf_counter()
+        span = self._find_span()
+        if span is None:
+            return
+        if span.skipped:
+            span.skipped -= 1
+        else:
+            _pop_span(span, stop_time, self.sample_rate)
+
+    def _find_span(self) -> Optional[_Span]:
+        """
+        Return the running span of this section in the current thread/task, spans
+        started after it (e.g. with pp_start) may still be running on top of it
+        """
+        span = _spans.get()
+        while span is not None and (span.owner is not self or span.stopped):
+            span = span.parent
+        return span
+
+
+def pp_section(name: str, sample_rate: int = 1, memory: bool = False) -> _PPSection:
+    """
+    Return a context manager measuring the code it wraps with the perf counter `name`.
+    The counter is bound once, so the returned object can be created once
+    and reused, e.g. in hot loops:
+
+    section = pp_section("loop body")
+    for x in xs:
+        with section:
+            ...
+
+    If sample_rate is N > 1, only 1 in N rounds is measured.
+    If memory is True, the memory allocated by the section is measured too,
+    see pp_track_memory.
+    """
+    return _PPSection(name, sample_rate, memory)
+
+
+def pp_profile(
+    name: Optional[str] = None, sample_rate: int = 1, memory: bool = False
+) -> Callable[[_F], _F]:
+    """
+    Decorator measuring each call of a function (sync or async) with the
+    perf counter `name`, the qualified name of the function by default.
+    If sample_rate is N > 1, only 1 in N calls is measured.
+    If memory is True, the memory allocated by the calls is measured too,
+    see pp_track_memory.
+    Usage:
+
+    @pp_profile("foo", sample_rate=100)
+    def foo():
+        pass
+    """
+    if sample_rate < 1:
+        raise ValueError("sample_rate must be at least 1")
+
+    def decorator(func: _F) -> _F:
+        import inspect  # pylint: disable=import-outside-toplevel
+
+        counter_name = name or func.__qualname__
+        pp = _get_pp(counter_name)
+        if memory:
+            pp_track_memory(counter_name)
+        countdown = sample_rate
+
+        def push() -> _Span:
+            nonlocal pp
+            if pp.detached:
+                pp = _get_pp(counter_name)
+            return _push_span(pp, _spans.get(), func)
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                nonlocal countdown
+                countdown -= 1
+                if countdown:
+                    return await func(*args, **kwargs)
+                countdown = sample_rate
+                span = push()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _pop_span(span, time.perf_counter(), sample_rate)
+
+            return async_wrapper  # type: ignore
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            nonlocal countdown
+            countdown -= 1
+            if countdown:
+                return func(*args, **kwargs)
+            countdown = sample_rate
+            span = push()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _pop_span(span, time.perf_counter(), sample_rate)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+# Layout of the header of a slot of the shared segment: sequence number, pid, payload length
+_SLOT_HEADER = struct.Struct("QQQ")
+
+
+class _SharedStats:
+    """
+    Shared memory segment where processes publish snapshots of their perf counters.
+    The segment is split in slots, each written only by the process owning it,
+    so no lock is needed to publish. Each slot starts with a sequence number which
+    is odd while the slot is being written (seqlock), so readers can detect torn reads.
+    """
+
+    def __init__(self, group: str, slots: int = 0, slot_size: int = 1 << 16):
+        from multiprocessing import shared_memory  # pylint: disable=import-outside-toplevel
+
+        self.group = group
+        name = f"frittomisto_pp_{group}"
+        try:
+            if not slots:
+                raise FileExistsError
+            self.shm = shared_memory.SharedMemory(name, create=True, size=slots * slot_size)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name)
+        buf = self.shm.buf
+        assert buf is not None
+        self.buf: memoryview = buf
+        # The segment outlives the processes using it, don't let them unlink it on exit
+        self._track(False)
+        self.slot_size = slot_size
+        self.slots = self.shm.size // slot_size
+        self.slot: Optional[int] = None
+        self.pid = os.getpid()
+
+    def _track(self, track: bool) -> None:
+        from multiprocessing import resource_tracker  # pylint: disable=import-outside-toplevel
+
+        name = self.shm._name  # type: ignore # pylint: disable=protected-access
+        if track:
+            resource_tracker.register(name, "shared_memory")
+        else:
+            resource_tracker.unregister(name, "shared_memory")
+
+    def unlink(self) -> None:
+        """
+        Remove the shared memory segment
+        """
+        # SharedMemory.unlink also unregisters the segment from the resource tracker
+        self._track(True)
+        self.shm.unlink()
+
+    def claim_slot(self) -> None:
+        """
+        Claim a free slot, or the slot of a process which exited, for the current process
+        """
+        with open(os.path.expanduser("~/.frittomisto_lock"), "w", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                pids = [self._read_header(i)[1] for i in range(self.slots)]
+                free = [i for i, pid in enumerate(pids) if pid == 0]
+                if not free:
+                    free = [i for i, pid in enumerate(pids) if not _pid_alive(pid)]
+                if not free:
+                    raise RuntimeError(f"No free slot in the shared stats of group {self.group}")
+                self.slot = free[0]
+                self.pid = os.getpid()
+                _SLOT_HEADER.pack_into(self.buf, self.slot * self.slot_size, 0, self.pid, 0)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def release_slot(self) -> None:
+        """
+        Release the slot of the current process, dropping its snapshot
+        """
+        if self.slot is not None:
+            _SLOT_HEADER.pack_into(self.buf, self.slot * self.slot_size, 0, 0, 0)
+            self.slot = None
+
+    def _read_header(self, slot: int) -> Tuple[int, int, int]:
+        return _SLOT_HEADER.unpack_from(self.buf, slot * self.slot_size)
+
+    def publish(self, counters: Dict[str, _PP]) -> None:
+        """
+        Write a snapshot of `counters` in the slot of the current process
+        """
+        if self.slot is None or self.pid != os.getpid():
+            self.claim_slot()
+        assert self.slot is not None
+        payload = json.dumps({name: pp.to_state() for name, pp in counters.items()}).encode()
+        if len(payload) > self.slot_size - _SLOT_HEADER.size:
+            raise ValueError(f"Perf counters snapshot too large ({len(payload)} bytes)")
+        offset = self.slot * self.slot_size
+        seq = self._read_header(self.slot)[0]
+        _SLOT_HEADER.pack_into(self.buf, offset, seq + 1, self.pid, 0)
+        start = offset + _SLOT_HEADER.size
+        self.buf[start : start + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self.buf, offset, seq + 2, self.pid, len(payload))
+
+    def collect(self) -> Dict[int, Dict[str, _PP]]:
+        """
+        Read the snapshots of all the processes, indexed by pid
+        """
+        snapshots: Dict[int, Dict[str, _PP]] = {}
+        for slot in range(self.slots):
+            for _ in range(100):
+                seq, pid, length = self._read_header(slot)
+                if seq % 2:
+                    continue
+                start = slot * self.slot_size + _SLOT_HEADER.size
+                payload = bytes(self.buf[start : start + length])
+                if self._read_header(slot)[0] == seq:
+                    break
+            else:
+                continue
+            if pid and length:
+                snapshots[pid] = {
+                    name: _PP.from_state(name, state)
+                    for name, state in json.loads(payload).items()
+                }
+        return snapshots
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Sharing:
+    """
+    State of the sharing of the perf counters of the current process, see pp_share
+    """
+
+    stats: Optional[_SharedStats] = None
+    interval: Optional[float] = None
+    thread: Optional[threading.Thread] = None
+    stop = threading.Event()
+    # Whether a snapshot too large for the slot was reported
+    warned = False
+
+
+def _flush_in_background() -> None:
+    """
+    Flush from the background thread or at exit, where errors cannot be raised
+    to the user: warn once if the snapshot doesn't fit in the slot
+    """
+    try:
+        pp_flush()
+    except ValueError as e:
+        if not _Sharing.warned:
+            _Sharing.warned = True
+            warnings.warn(
+                f"{e}, the perf counters of process {os.getpid()} are not shared:"
+                " increase slot_size in pp_share",
+                RuntimeWarning,
+            )
+
+
+def _flush_loop(stop: threading.Event, interval: float) -> None:
+    while not stop.wait(interval):
+        _flush_in_background()
+
+
+def _start_flush_thread() -> None:
+    if _Sharing.interval is None:
+        return
+    _Sharing.stop = threading.Event()
+    _Sharing.thread = threading.Thread(
+        target=_flush_loop, args=(_Sharing.stop, _Sharing.interval), daemon=True
+    )
+    _Sharing.thread.start()
+
+
+def _after_fork_in_child() -> None:
+    # Children start with fresh counters and their own slot, so that the
+    # measures of the parent are not counted twice
+    if _Sharing.stats is not None:
+        pp_reset()
+        _Sharing.stats.slot = None
+        _start_flush_thread()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pp_share(
+    group: str = "default",
+    flush_interval: Optional[float] = 1.0,
+    slots: int = 64,
+    slot_size: int = 1 << 16,
+) -> None:
+    """
+    Publish the perf counters of this process in the shared memory segment of `group`,
+    so that the counters of all the processes of the group can be aggregated with
+    pp_collect or pp_stats(aggregate=True).
+    Counters are published every `flush_interval` seconds by a background thread
+    (if not None), on exit, and when calling pp_flush. Recording measures is not affected.
+    Forked children are shared too, and start with fresh counters.
+    The segment is created by the first process of the group (with `slots` slots of
+    `slot_size` bytes) and must be removed with pp_unshare(unlink=True).
+    """
+    pp_unshare()
+    _Sharing.stats = _SharedStats(group, slots, slot_size)
+    _Sharing.stats.claim_slot()
+    _Sharing.interval = flush_interval
+    _Sharing.warned = False
+    _start_flush_thread()
+
+
+def pp_flush() -> None:
+    """
+    Publish the perf counters of this process now, see pp_share
+    """
+    if _Sharing.stats is None:
+        raise RuntimeError("Perf counters are not shared, call pp_share first")
+    _Sharing.stats.publish(dict(__pp__))
+
+
+def pp_unshare(unlink: bool = False) -> None:
+    """
+    Stop publishing the perf counters of this process and remove its snapshot.
+    If `unlink` is True, also remove the shared memory segment of the group.
+    """
+    if _Sharing.stats is None:
+        return
+    _Sharing.stop.set()
+    if _Sharing.thread is not None:
+        _Sharing.thread.join()
+        _Sharing.thread = None
+    _Sharing.stats.release_slot()
+    _Sharing.stats.shm.close()
+    if unlink:
+        _Sharing.stats.unlink()
+    _Sharing.stats = None
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    if _Sharing.stats is not None:
+        _flush_in_background()
+
+
+def pp_collect(group: Optional[str] = None) -> Dict[str, _PP]:
+    """
+    Return the perf counters of all the processes of `group` (by default the
+    group of this process, see pp_share), merged by name.
+    """
+    if group is None or (_Sharing.stats is not None and group == _Sharing.stats.group):
+        if _Sharing.stats is None:
+            raise RuntimeError("Perf counters are not shared, call pp_share first")
+        pp_flush()
+        stats = _Sharing.stats
+        snapshots = stats.collect()
+    else:
+        stats = _SharedStats(group)
+        snapshots = stats.collect()
+        stats.shm.close()
+
+    merged: Dict[str, _PP] = {}
+    for counters in snapshots.values():
+        for name, pp in counters.items():
+            if name in merged:
+                merged[name].merge(pp)
+            else:
+                merged[name] = pp
+    return merged
+
+
+# A sampled stack: call path of the running spans, and code of the frames (outermost first)
+_SampleKey = Tuple[Tuple[str, ...], Tuple[CodeType, ...]]
+
+
+class _Sampler:
+    """
+    State of the sampling profiler, see pp_sample_start
+    """
+
+    samples: Dict[_SampleKey, int] = {}
+    interval: float = 0
+    # Number of SIGPROF received, and CPU time of the process while sampling
+    ticks = 0
+    cpu_start: Optional[float] = None
+    cpu_time: float = 0
+    all_threads = False
+    max_depth = 0
+    previous_handler: Any = None
+
+
+def _sample_stack(frame: Optional[FrameType]) -> Tuple[CodeType, ...]:
+    stack: List[CodeType] = []
+    while frame is not None and len(stack) < _Sampler.max_depth:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _on_sample(_signum: int, frame: Optional[FrameType]) -> None:
+    """
+    SIGPROF handler, it runs in the main thread while `frame` is running
+    """
+    _Sampler.ticks += 1
+    samples = _Sampler.samples
+    span = _spans.get()
+    key = (_span_path(span) if span is not None else (), _sample_stack(frame))
+    samples[key] = samples.get(key, 0) + 1
+    if _Sampler.all_threads:
+        main = threading.main_thread().ident
+        for ident, thread_frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident != main:
+                # The spans of other threads are not visible from the handler
+                key = ((), _sample_stack(thread_frame))
+                samples[key] = samples.get(key, 0) + 1
+
+
+def pp_sample_start(interval: float = 0.01, all_threads: bool = False, max_depth: int = 64):
+    """
+    Start a statistical profiler which samples the Python stack every `interval` seconds
+    of CPU time of the process (using SIGPROF), attributing each sample to the innermost
+    running perf counter. The overhead is proportional to 1 / `interval`.
+    If `all_threads` is True, the stacks of all threads are sampled (the samples of
+    threads other than the main thread are not attributed to perf counters).
+    Samples collected so far are dropped. Must be called from the main thread.
+    """
+    pp_sample_stop()
+    _Sampler.samples = {}
+    _Sampler.ticks = 0
+    _Sampler.cpu_time = 0
+    _Sampler.cpu_start = time.process_time()
+    _Sampler.interval = interval
+    _Sampler.all_threads = all_threads
+    _Sampler.max_depth = max_depth
+    _Sampler.previous_handler = signal.signal(signal.SIGPROF, _on_sample)
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+
+def pp_sample_stop() -> None:
+    """
+    Stop the statistical profiler, see pp_sample_start
+    """
+    if _Sampler.previous_handler is None:
+        return
+    signal.setitimer(signal.ITIMER_PROF, 0)
+    _Sampler.cpu_time = _sample_cpu_time()
+    signal.signal(signal.SIGPROF, _Sampler.previous_handler)
+    _Sampler.previous_handler = None
+
+
+def _sample_cpu_time() -> float:
+    if _Sampler.previous_handler is None or _Sampler.cpu_start is None:
+        return _Sampler.cpu_time
+    return time.process_time() - _Sampler.cpu_start
+
+
+def _sample_period() -> float:
+    """
+    Return the CPU time represented by a sample. The kernel may deliver
+    SIGPROF less often than requested, so it is measured rather than assumed.
+    """
+    if not _Sampler.ticks:
+        return _Sampler.interval
+    return _sample_cpu_time() / _Sampler.ticks
+
+
+def _code_label(code: CodeType) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def pp_sample_collapsed(fp: TextIO) -> None:
+    """
+    Write the sampled stacks to `fp` as collapsed stacks (one "a;b;c <samples>" line
+    per stack, prefixed by the running perf counters), the input format of flamegraph tools.
+    """
+    stacks: Dict[str, int] = {}
+    for (path, stack), n in list(_Sampler.samples.items()):
+        line = ";".join(chain(path, map(_code_label, stack)))
+        stacks[line] = stacks.get(line, 0) + n
+    for line, n in stacks.items():
+        fp.write(f"{line} {n}\n")
+
+
+_Row = List[Union[str, int, float]]
+
+
+def _print_table(headers: List[str], rows: List[_Row]) -> None:
+    """
+    Pretty print a table, holding a lock so that tables of different processes do not mix
     """
 
     def _truncate(string: str, max_length: int):
@@ -110,20 +1190,13 @@ def pp_stats():
             return string[: max_length - 3] + "..."
         return string
 
-    def _print_row(row: Union[List[str], List[Union[str, int, float]]], column_widths: List[int]):
+    def _print_row(row: Union[List[str], _Row], column_widths: List[int]):
         """
         Print a row of the table
         """
         formatted_row = [_truncate(str(item), w).ljust(w) for item, w in zip(row, column_widths)]
         print(" | ".join(formatted_row))
 
-    # Determine the maximum width of each column
-    headers: List[str] = ["PID", "Name", "tot_time", "rounds", "avg_time", "max_time"]
-    rows: List[List[Union[str, int, float]]] = [
-        [os.getpid(), pp.name, pp.tot_time, pp.rounds, pp.tot_time / pp.rounds, pp.max_time]
-        for pp in sorted(__pp__.values(), key=lambda pp: pp.tot_time, reverse=True)
-    ]
-
     # Ensure that all rows have the same number of columns
     assert all(len(headers) == len(r) for r in rows)
 
@@ -139,18 +1212,268 @@ def pp_stats():
         fcntl.flock(f, fcntl.LOCK_EX)
         try:
             _print_row(headers, column_widths)
-            for pp in sorted(__pp__.values(), key=lambda pp: pp.tot_time, reverse=True):
-                _print_row(
-                    [
-                        os.getpid(),
-                        pp.name,
-                        pp.tot_time,
-                        pp.rounds,
-                        pp.tot_time / pp.rounds,
-                        pp.max_time,
-                    ],
-                    column_widths,
-                )
+            for row in rows:
+                _print_row(row, column_widths)
             print()
         finally:
             fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _tree_rows() -> List[_Row]:
+    """
+    Return the rows of the call tree, depth first, the slowest children first
+    """
+    children: Dict[Tuple[str, ...], List[Tuple[str, ...]]] = {}
+    for path in __pp_tree__:
+        children.setdefault(path[:-1], []).append(path)
+
+    rows: List[_Row] = []
+
+    def _add_rows(parent: Tuple[str, ...]) -> None:
+        paths = sorted(children.get(parent, []), key=lambda p: __pp_tree__[p].tot_time)
+        for path in reversed(paths):
+            pp = __pp_tree__[path]
+            rows.append(
+                [
+                    os.getpid(),
+                    "  " * (len(path) - 1) + pp.name,
+                    pp.tot_time,
+                    pp.self_time,
+                    pp.rounds,
+                    pp.tot_time / pp.rounds if pp.rounds else 0,
+                    pp.percentile(50),
+                    pp.percentile(99),
+                    pp.max_time,
+                ]
+            )
+            _add_rows(path)
+
+    _add_rows(())
+    return rows
+
+
+def pp_sample_stats(top: int = 20) -> None:
+    """
+    Pretty print the `top` functions where the statistical profiler found the process
+    running the most (self_samples), for each perf counter running at that time.
+    tot_samples also counts the samples where the function was calling other functions,
+    and times are estimated from the CPU time of the process while sampling.
+    """
+    self_samples: Dict[Tuple[str, CodeType], int] = {}
+    tot_samples: Dict[Tuple[str, CodeType], int] = {}
+    for (path, stack), n in list(_Sampler.samples.items()):
+        section = ";".join(path) or "-"
+        if stack:
+            key = (section, stack[-1])
+            self_samples[key] = self_samples.get(key, 0) + n
+        for code in set(stack):
+            tot_samples[(section, code)] = tot_samples.get((section, code), 0) + n
+
+    headers = ["PID", "Counter", "Function", "self_samples", "self_time", "tot_samples", "tot_time"]
+    period = _sample_period()
+    keys = sorted(tot_samples, key=lambda k: (self_samples.get(k, 0), tot_samples[k]))
+    rows: List[_Row] = [
+        [
+            os.getpid(),
+            section,
+            _code_label(code),
+            self_samples.get((section, code), 0),
+            self_samples.get((section, code), 0) * period,
+            tot_samples[(section, code)],
+            tot_samples[(section, code)] * period,
+        ]
+        for section, code in reversed(keys[-top:])
+    ]
+    _print_table(headers, rows)
+
+
+def _environment() -> Dict[str, Any]:
+    """
+    Return info about the machine and interpreter, to tell apart runs done in different setups
+    """
+    import platform  # pylint: disable=import-outside-toplevel
+    import socket  # pylint: disable=import-outside-toplevel
+
+    return {
+        "time": time.time(),
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "argv": sys.argv,
+    }
+
+
+def pp_save(path: str, aggregate: bool = False) -> None:
+    """
+    Save a snapshot of the perf counters (totals, rounds, percentiles,
+    histograms) and info about the environment in the JSON file `path`,
+    e.g. to use it as a baseline for pp_compare.
+    If `aggregate` is True, save the counters of all the processes sharing them (see pp_share).
+    """
+    counters = pp_collect() if aggregate else __pp__
+    snapshot = {
+        "environment": _environment(),
+        "counters": {
+            name: dict(
+                pp.to_state(),
+                avg_time=pp.tot_time / pp.rounds if pp.rounds else 0,
+                p50=pp.percentile(50),
+                p99=pp.percentile(99),
+            )
+            for name, pp in counters.items()
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2)
+
+
+def _load_snapshot(path: str) -> Tuple[Dict[str, Any], Dict[str, _PP]]:
+    """
+    Return the environment and the perf counters saved by pp_save in the JSON file `path`
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    counters = {
+        name: _PP.from_state(name, state) for name, state in snapshot["counters"].items()
+    }
+    return snapshot["environment"], counters
+
+
+def pp_load(path: str) -> Dict[str, _PP]:
+    """
+    Load the perf counters saved by pp_save in the JSON file `path`
+    """
+    return _load_snapshot(path)[1]
+
+
+def _warn_environment(environment: Dict[str, Any]) -> None:
+    """
+    Warn if `environment` is not the current one, so that measures may not be comparable
+    """
+    current = _environment()
+    changed = [
+        k for k in ("hostname", "platform", "cpu_count", "python", "implementation")
+        if environment.get(k) != current[k]
+    ]
+    if changed:
+        print(f"Warning: the environment of the baseline is different ({', '.join(changed)})")
+
+
+def _compare_counter(
+    old: _PP, new: _PP, min_slowdown: float, min_z: float
+) -> Tuple[float, float, str]:
+    """
+    Return the slowdown of `new` compared to `old`, its z-score and its status, see pp_compare
+    """
+    old_avg, new_avg = old.tot_time / old.rounds, new.tot_time / new.rounds
+    ratio = new_avg / old_avg if old_avg else math.inf
+    stderr = math.sqrt(old.variance() / old.rounds + new.variance() / new.rounds)
+    if stderr:
+        z = (new_avg - old_avg) / stderr
+    else:
+        z = math.copysign(math.inf, new_avg - old_avg) if new_avg != old_avg else 0
+    if ratio >= min_slowdown and z >= min_z:
+        return ratio, z, "SLOWER"
+    if ratio <= 1 / min_slowdown and z <= -min_z:
+        return ratio, z, "faster"
+    return ratio, z, "ok"
+
+
+def pp_compare(
+    baseline: str,
+    min_slowdown: float = 1.1,
+    min_z: float = 3.0,
+    aggregate: bool = False,
+) -> Dict[str, float]:
+    """
+    Compare the perf counters with the baseline saved by pp_save in the file `baseline`,
+    print the comparison and return the slowdowns (ratio of the average times) of the
+    counters which are significantly slower than in the baseline.
+    A counter is significantly slower when its average time is at least `min_slowdown`
+    times the one of the baseline, and the difference is at least `min_z` standard
+    errors (Welch's test), so that noisy counters measured a few times are not flagged.
+    If `aggregate` is True, compare the counters of all the processes sharing them (see pp_share).
+    """
+    environment, before = _load_snapshot(baseline)
+    _warn_environment(environment)
+    after = pp_collect() if aggregate else __pp__
+    slowdowns: Dict[str, float] = {}
+    rows: List[_Row] = []
+    for name in sorted(set(before) | set(after)):
+        old, new = before.get(name), after.get(name)
+        if old is None or not old.rounds:
+            new_avg = new.tot_time / new.rounds if new and new.rounds else 0
+            rows.append([name, "-", new_avg, "-", "-", "new"])
+        elif new is None or not new.rounds:
+            rows.append([name, old.tot_time / old.rounds, "-", "-", "-", "missing"])
+        else:
+            comparison = _compare_counter(old, new, min_slowdown, min_z)
+            if comparison[2] == "SLOWER":
+                slowdowns[name] = comparison[0]
+            rows.append([name, old.tot_time / old.rounds, new.tot_time / new.rounds, *comparison])
+
+    _print_table(["Name", "base_avg_time", "avg_time", "ratio", "z", "status"], rows)
+    return slowdowns
+
+
+def pp_stats(tree: bool = False, aggregate: bool = False):
+    """ 
+    Pretty print perf counters stats.
+    If `tree` is True, print the call tree of the perf counters instead,
+    with the inclusive (tot_time) and exclusive (self_time) time of each path.
+    If `aggregate` is True, print the counters of all the processes sharing
+    them (see pp_share), merged by name.
+    Event counters (see pp_count) are printed in a second table.
+    If the statistical profiler collected samples (see pp_sample_start),
+    also print its report, see pp_sample_stats.
+    """
+    if tree:
+        if not _Tree.enabled:
+            raise RuntimeError("The call tree is not enabled, call pp_tree first")
+        _print_table(
+            [
+                "PID", "Name", "tot_time", "self_time", "rounds",
+                "avg_time", "p50", "p99", "max_time",
+            ],
+            _tree_rows(),
+        )
+        return
+
+    headers: List[str] = [
+        "PID", "Name", "tot_time", "rounds", "avg_time", "p50", "p99", "max_time"
+    ]
+    counters = pp_collect() if aggregate else __pp__
+    rows: List[_Row] = [
+        [
+            "*" if aggregate else os.getpid(),
+            pp.name,
+            pp.tot_time,
+            pp.rounds,
+            pp.tot_time / pp.rounds if pp.rounds else 0,
+            pp.percentile(50),
+            pp.percentile(99),
+            pp.max_time,
+        ]
+        for pp in sorted(counters.values(), key=lambda pp: pp.tot_time, reverse=True)
+    ]
+    # Memory columns are only shown when some counter tracks its memory
+    if any(pp.mem_rounds for pp in counters.values()):
+        headers += ["mem/round", "mem_peak"]
+        for row in rows:
+            pp = counters[str(row[1])]
+            if pp.mem_rounds:
+                row += [pp.mem_net // pp.mem_rounds, pp.mem_peak]
+            else:
+                row += ["-", "-"]
+    _print_table(headers, rows)
+    if __pp_counts__ and not aggregate:
+        _print_table(
+            ["PID", "Name", "count"],
+            [[os.getpid(), name, n] for name, n in sorted(__pp_counts__.items())],
+        )
+    if _Sampler.samples and not aggregate:
+        pp_sample_stats()
@@ -2,7 +2,24 @@
 Test async utilities
 """
 import asyncio
-from frittomisto.asyncio import make_sync
+import os
+import time
+from functools import partial, wraps
+from typing import AsyncIterator, Callable, Iterator, List
+import pytest
+from frittomisto.asyncio import (
+    make_sync,
+    background_loop,
+    bounded_map,
+    TokenBucket,
+    async_cached,
+    offload,
+    pool_map,
+    get_pool,
+    warm_up_pool,
+    shutdown_pools,
+)
+from frittomisto.profiling import pp_get_count
 
 
 @make_sync
@@ -18,3 +35,367 @@ def test_make_sync() -> None:
     Test make_sync
     """
     assert async_increment(1) == 2
+
+
+@make_sync(persistent=True)
+async def persistent_loop_id() -> int:
+    """
+    A function run in the background loop
+    """
+    await asyncio.sleep(0)
+    return id(asyncio.get_running_loop())
+
+
+def test_make_sync_persistent() -> None:
+    """
+    Test running async functions in the persistent background loop
+    """
+    loop_id = persistent_loop_id()
+    assert persistent_loop_id() == loop_id
+    assert id(background_loop()) == loop_id
+
+    # Calling from a running loop blocks it, but works
+    async def _from_loop() -> int:
+        return persistent_loop_id()
+
+    assert asyncio.run(_from_loop()) == loop_id
+
+    # Calling from the background loop itself would deadlock
+    async def _from_background_loop() -> int:
+        return persistent_loop_id()
+
+    future = asyncio.run_coroutine_threadsafe(_from_background_loop(), background_loop())
+    with pytest.raises(RuntimeError, match="deadlock"):
+        future.result()
+
+
+@pytest.mark.parametrize("persistent", [False, True])
+def test_make_sync_generator(persistent: bool) -> None:
+    """
+    Test running async generator functions synchronously
+    """
+    closed = []
+
+    async def _count(n: int) -> AsyncIterator[int]:
+        try:
+            for i in range(n):
+                await asyncio.sleep(0)
+                yield i
+        finally:
+            closed.append(n)
+
+    count = make_sync(persistent=persistent)(_count)
+    assert list(count(3)) == [0, 1, 2]
+    assert closed == [3]
+
+    for i in count(10):
+        if i == 2:
+            break
+    assert closed == [3, 10]
+
+
+def test_bounded_map() -> None:
+    """
+    Test mapping an async function with a concurrency limit
+    """
+    running = 0
+    max_running = 0
+    pulled = 0
+
+    async def _double(x: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        # Later items finish first
+        await asyncio.sleep(0.001 * (10 - x))
+        running -= 1
+        return 2 * x
+
+    def _items() -> Iterator[int]:
+        nonlocal pulled
+        for i in range(10):
+            pulled += 1
+            yield i
+
+    async def _collect(ordered: bool) -> List[int]:
+        nonlocal pulled
+        pulled = 0
+        results = []
+        async for result in bounded_map(_double, _items(), concurrency=3, ordered=ordered):
+            # Items are only pulled when a call can start
+            assert pulled <= len(results) + 4
+            results.append(result)
+        return results
+
+    assert asyncio.run(_collect(ordered=True)) == [2 * i for i in range(10)]
+    assert max_running == 3
+    unordered = asyncio.run(_collect(ordered=False))
+    assert sorted(unordered) == [2 * i for i in range(10)]
+    assert unordered != sorted(unordered)
+
+    # Sync code can drive it
+    assert list(make_sync(bounded_map)(_double, range(5), 2)) == [0, 2, 4, 6, 8]
+
+
+def test_bounded_map_errors() -> None:
+    """
+    Test that errors stop bounded_map and cancel the running calls
+    """
+    cancelled = []
+
+    async def _fail(x: int) -> int:
+        if x == 1:
+            raise ValueError(x)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(x)
+            raise
+        return x
+
+    async def _collect() -> List[int]:
+        return [r async for r in bounded_map(_fail, range(100), concurrency=4)]
+
+    with pytest.raises(ValueError):
+        asyncio.run(_collect())
+    assert sorted(cancelled) == [0, 2, 3]
+
+
+def test_bounded_map_streaming() -> None:
+    """
+    Test that results are yielded without waiting for the next items or tokens
+    """
+    async def _identity(x: int) -> int:
+        return x
+
+    async def _first_then_wait() -> List[int]:
+        received = asyncio.Event()
+
+        async def _items() -> AsyncIterator[int]:
+            yield 0
+            # Only produced once the first result was received
+            await received.wait()
+            yield 1
+
+        results = []
+        async for result in bounded_map(_identity, _items(), concurrency=4):
+            results.append(result)
+            received.set()
+        return results
+
+    assert asyncio.run(asyncio.wait_for(_first_then_wait(), 5)) == [0, 1]
+
+    async def _first_rate_limited() -> float:
+        limiter = TokenBucket(rate=1, capacity=1)
+        start = time.monotonic()
+        async for _ in bounded_map(_identity, range(4), concurrency=4, rate_limiter=limiter):
+            break
+        return time.monotonic() - start
+
+    # The next token is available after 1s
+    assert asyncio.run(_first_rate_limited()) < 0.5
+
+
+def test_token_bucket() -> None:
+    """
+    Test rate limiting with a token bucket
+    """
+    bucket = TokenBucket(rate=200, capacity=2)
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire()
+
+    async def _identity(x: int) -> int:
+        return x
+
+    async def _collect() -> List[int]:
+        limiter = TokenBucket(rate=200, capacity=1)
+        return [r async for r in bounded_map(_identity, range(11), rate_limiter=limiter)]
+
+    start = time.monotonic()
+    assert asyncio.run(_collect()) == list(range(11))
+    assert time.monotonic() - start >= 0.045
+    with pytest.raises(ValueError):
+        asyncio.run(bucket.acquire(3))
+
+
+def test_async_cached() -> None:
+    """
+    Test caching the results of an async function
+    """
+    calls: List[int] = []
+
+    @async_cached(maxsize=2, name="test_async_cached")
+    async def _square(x: int, delay: float = 0.01) -> int:
+        calls.append(x)
+        await asyncio.sleep(delay)
+        if x < 0:
+            raise ValueError(x)
+        return x * x
+
+    async def _main() -> None:
+        # Concurrent calls share a single call
+        assert await asyncio.gather(*(_square(2) for _ in range(5))) == [4] * 5
+        assert calls == [2]
+        assert await _square(2) == 4
+        assert calls == [2]
+
+        # Least recently used results are evicted
+        await _square(3)
+        await _square(2)
+        await _square(4)
+        assert await _square(2) == 4
+        await _square(3)
+        assert calls == [2, 3, 4, 3]
+
+        # Errors are not cached
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await _square(-1)
+        assert calls == [2, 3, 4, 3, -1, -1]
+
+        # Cancelling a caller does not cancel the shared call
+        first = asyncio.ensure_future(_square(5, delay=0.05))
+        second = asyncio.ensure_future(_square(5, delay=0.05))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 25
+
+    asyncio.run(_main())
+    info = _square.cache_info()  # type: ignore
+    assert (info.hits, info.misses, info.coalesced) == (3, 7, 5)
+    assert info.evictions == 3
+    assert info.size == 2
+    assert pp_get_count("test_async_cached.hits") == 3
+    _square.cache_clear()  # type: ignore
+    assert _square.cache_info().size == 0  # type: ignore
+
+
+def test_async_cached_bounds() -> None:
+    """
+    Test the expiration and memory bound of cached results
+    """
+
+    @async_cached(maxsize=None, ttl=0.05, max_bytes=3000, sizeof=len)
+    async def _data(n: int) -> bytes:
+        return bytes(n)
+
+    async def _main() -> None:
+        for n in (1000, 1001, 1002):
+            await _data(n)
+        assert _data.cache_info().nbytes == 3003 - 1000  # type: ignore
+        await _data(1002)
+        assert _data.cache_info().hits == 1  # type: ignore
+        await asyncio.sleep(0.06)
+        await _data(1002)
+        assert _data.cache_info().misses == 4  # type: ignore
+
+    asyncio.run(_main())
+
+
+@offload
+def offloaded_pid(x: int) -> int:
+    """
+    Return the pid of the worker running it, fails on negative numbers
+    """
+    if x < 0:
+        raise ValueError(x)
+    return os.getpid()
+
+
+def square(x: int) -> int:
+    """
+    Return x * x
+    """
+    return x * x
+
+
+def add_one(func: Callable[[int], int]) -> Callable[[int], int]:
+    """
+    Decorator adding one to the result of func
+    """
+    @wraps(func)
+    def wrapper(x: int) -> int:
+        return func(x) + 1
+    return wrapper
+
+
+@add_one
+def double_plus_one(x: int) -> int:
+    """
+    Decorated functions are sent as they are to the workers
+    """
+    return 2 * x
+
+
+class Multiplier:
+    """
+    Bound methods are sent with their instance to the workers
+    """
+
+    def __init__(self, factor: int):
+        self.factor = factor
+
+    def multiply(self, x: int) -> int:
+        """
+        Multiply x by the factor
+        """
+        return self.factor * x
+
+
+def test_offload() -> None:
+    """
+    Test running sync functions in the shared pools
+    """
+
+    @offload(kind="thread")
+    def _blocking(delay: float) -> float:
+        time.sleep(delay)
+        return delay
+
+    async def _main() -> None:
+        assert await offloaded_pid(1) != os.getpid()
+        with pytest.raises(ValueError):
+            await offloaded_pid(-1)
+        start = time.perf_counter()
+        assert await asyncio.gather(*(_blocking(0.1) for _ in range(4))) == [0.1] * 4
+        assert time.perf_counter() - start < 0.35
+
+    warm_up_pool("process", max_workers=2)
+    try:
+        asyncio.run(_main())
+        with pytest.raises(ValueError):
+            get_pool("gpu")
+    finally:
+        shutdown_pools()
+    # Pools are created again after a shutdown
+    asyncio.run(_main())
+
+
+def test_pool_map() -> None:
+    """
+    Test mapping functions over items in chunks
+    """
+
+    async def _main() -> None:
+        items = list(range(100))
+        assert await pool_map(square, items) == [x * x for x in items]
+        assert await pool_map(square, items, chunksize=7) == [x * x for x in items]
+        assert await pool_map(lambda x: -x, items, kind="thread") == [-x for x in items]
+        assert await pool_map(square, []) == []
+
+    asyncio.run(_main())
+
+
+def test_pool_map_callables() -> None:
+    """
+    Test mapping decorated functions, bound methods and partials in processes
+    """
+
+    async def _main() -> None:
+        items = [1, 2]
+        for func in (double_plus_one, Multiplier(3).multiply, partial(max, 2)):
+            expected = [func(x) for x in items]
+            assert await pool_map(func, items) == expected
+            assert await pool_map(func, items, kind="thread") == expected
+
+    asyncio.run(_main())
@@ -2,9 +2,12 @@
 Test cfg utilities
 """
 import tempfile
+import threading
 import os
+from typing import Any, Dict, List
 import pytest
-from frittomisto.cfg import cfg
+import toml
+from frittomisto.cfg import cfg, FrittoMistoCfg
 from frittomisto.path import cd
 
 
@@ -50,3 +53,155 @@ def test_find_cfg() -> None:
         with cd(child_dir):
             assert cfg["foo"]["bar"] == 1
             assert cfg["foo"]["baz"] == "hello"
+
+
+def _write_cfg(path: str, value: int) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"[foo]\nbar = {value}\n")
+
+
+def test_reload_cfg() -> None:
+    """
+    Test reloading a config file when it changes
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.toml")
+        _write_cfg(path, 1)
+        config = FrittoMistoCfg()
+        config.set_config_file(path)
+        changes: List[Dict[str, Any]] = []
+        config.subscribe(changes.append)
+        assert config["foo"]["bar"] == 1
+        assert not config.reload_if_changed()
+
+        # Changes are not seen without auto reload
+        _write_cfg(path, 22)
+        assert config["foo"]["bar"] == 1
+
+        config.set_auto_reload(0)
+        assert config["foo"]["bar"] == 22
+        assert changes == [{"foo": {"bar": 22}}]
+
+        # Invalid configs are not loaded
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[foo")
+        assert config["foo"]["bar"] == 22
+
+        config.set_auto_reload(0.01, watch=True)
+        reloaded = threading.Event()
+        config.subscribe(lambda _: reloaded.set())
+        _write_cfg(path, 333)
+        assert reloaded.wait(5)
+        assert config["foo"]["bar"] == 333
+        config.set_auto_reload(None)
+        assert len(changes) == 2
+
+
+def test_find_cfg_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that found config files are cached per working directory,
+    and looked up again, once the reload interval passed, when a closer one is created
+    """
+    config = FrittoMistoCfg()
+    config.set_config_names("test_cached.toml")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        child_dir = os.path.join(tmpdir, "a")
+        os.makedirs(child_dir)
+        path = os.path.realpath(os.path.join(tmpdir, "test_cached.toml"))
+        _write_cfg(path, 1)
+        with cd(child_dir):
+            assert config._find_config() == path  # pylint: disable=protected-access
+            with monkeypatch.context() as m:
+                m.setattr(os.path, "exists", None)
+                assert config._find_config() == path  # pylint: disable=protected-access
+            closer = os.path.join(os.path.realpath(child_dir), "test_cached.toml")
+            _write_cfg(closer, 2)
+            config.set_auto_reload(0)
+            assert config._find_config() == closer  # pylint: disable=protected-access
+            os.remove(closer)
+            assert config._find_config() == path  # pylint: disable=protected-access
+
+
+def test_cfg_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test caching parsed config files
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.toml")
+        cache_dir = os.path.join(tmpdir, "cache")
+        _write_cfg(path, 1)
+
+        def _load(expect_parse: bool) -> Any:
+            config = FrittoMistoCfg()
+            config.set_config_file(path)
+            config.set_cache_dir(cache_dir)
+            if expect_parse:
+                return config["foo"]["bar"]
+            with monkeypatch.context() as m:
+                m.setattr(toml, "loads", None)
+                return config["foo"]["bar"]
+
+        assert _load(expect_parse=True) == 1
+        assert len(os.listdir(cache_dir)) == 1
+        assert _load(expect_parse=False) == 1
+
+        _write_cfg(path, 22)
+        assert _load(expect_parse=True) == 22
+        assert _load(expect_parse=False) == 22
+
+        # Corrupted snapshots are ignored and replaced
+        (cache_file,) = os.listdir(cache_dir)
+        with open(os.path.join(cache_dir, cache_file), "wb") as f:
+            f.write(b"corrupted")
+        assert _load(expect_parse=True) == 22
+        assert _load(expect_parse=False) == 22
+        assert os.listdir(cache_dir) == [cache_file]
+
+
+def test_cfg_layers(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test merging defaults, config files and environment variables
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "test.toml")
+        extra_path = os.path.join(tmpdir, "extra.toml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('[foo]\nbar = 1\nbaz = "hello"\n[foo.sub]\nx = 1\n')
+        with open(extra_path, "w", encoding="utf-8") as f:
+            f.write("[foo.sub]\ny = 2\n")
+        monkeypatch.setenv("TESTCFG__FOO__SUB__X", "10")
+        monkeypatch.setenv("TESTCFG__NAME", "a string")
+        monkeypatch.setenv("TESTCFG__LIST", "[1, 2]")
+
+        config = FrittoMistoCfg()
+        config.set_config_file(path)
+        config.set_defaults({"foo": {"bar": 0, "default": True}, "other": 3})
+        config.set_extra_config_files([extra_path])
+        config.set_env_prefix("TESTCFG")
+
+        assert config["foo"] == {
+            "bar": 1,
+            "baz": "hello",
+            "default": True,
+            "sub": {"x": 10, "y": 2},
+        }
+        assert config.get("foo.sub.x") == 10
+        assert config.get("foo.sub.y") == 2
+        assert config["foo.default"] is True
+        assert config.get("other") == 3
+        assert config.get("name") == "a string"
+        assert config.get("list") == [1, 2]
+        assert config.get("foo.missing", 4) == 4
+        with pytest.raises(KeyError):
+            _ = config["foo.missing"]
+
+        # The index is updated on reload
+        with open(extra_path, "w", encoding="utf-8") as f:
+            f.write("[foo.sub]\nz = 3\n")
+        monkeypatch.delenv("TESTCFG__LIST")
+        config.reload()
+        assert config.get("foo.sub") == {"x": 10, "z": 3}
+        assert config.get("foo.sub.y") is None
+        assert config.get("foo.sub.z") == 3
+        assert config.get("list") is None
+        assert config.get("foo.bar") == 1
@@ -0,0 +1,53 @@
+"""
+Test lazy loading of the frittomisto modules
+"""
+import os
+import subprocess
+import sys
+from typing import List
+import pytest
+
+# Expensive modules which must only be imported when they are used
+LAZY_IMPORTS = {
+    "frittomisto": ["typing", "frittomisto.cfg", "frittomisto.profiling", "toml"],
+    "frittomisto.io": ["unittest", "unittest.mock"],
+    "frittomisto.cfg": ["toml", "pickle", "tempfile", "hashlib"],
+    "frittomisto.profiling": [
+        "inspect", "multiprocessing", "socket", "platform", "tracemalloc"
+    ],
+    "frittomisto.asyncio": ["multiprocessing", "concurrent.futures.process"],
+}
+
+
+def _imported_modules(module: str) -> List[str]:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print(' '.join(sys.modules))"],
+        cwd=root,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return out.split()
+
+
+@pytest.mark.parametrize("module", list(LAZY_IMPORTS))
+def test_lazy_imports(module: str) -> None:
+    """
+    Test that importing a module does not import expensive modules it does not need yet
+    """
+    imported = _imported_modules(module)
+    assert module in imported
+    assert not set(LAZY_IMPORTS[module]) & set(imported)
+
+
+def test_lazy_submodules() -> None:
+    """
+    Test accessing the submodules of frittomisto as attributes
+    """
+    import frittomisto  # pylint: disable=import-outside-toplevel
+
+    assert frittomisto.url.extract_urls("see https://example.com")
+    assert "cfg" in dir(frittomisto)
+    with pytest.raises(AttributeError):
+        _ = frittomisto.missing  # type: ignore # pylint: disable=no-member
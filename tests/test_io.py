@@ -0,0 +1,15 @@
+"""
+Test io utilities
+"""
+import pytest
+from frittomisto.io import no_print
+
+
+def test_no_print(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test disabling print
+    """
+    with no_print():
+        print("hidden", end="!")
+    print("shown")
+    assert capsys.readouterr().out == "shown\n"
@@ -1,9 +1,23 @@
 """
 Test the json module
 """
+import copy
+import io
+import json
+import pickle
+from array import array
 from dataclasses import dataclass
-from typing import Dict, Any, List, Optional
-from frittomisto.json import JSONSerializable
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+import pytest
+from frittomisto.json import (
+    JSONSerializable,
+    dumps,
+    invalidate_codecs,
+    set_json_parser,
+    write_json_lines,
+    _iter_json_array,
+)
 
 @dataclass
 class TestClass1(JSONSerializable):
@@ -52,4 +66,339 @@ def test_json_serializable():
     c = TestClass2(**JSON_MIRROR) # type: ignore
     assert c.to_dict() == JSON_MIRROR
     assert TestClass2.from_dict(JSON_MIRROR).to_dict() == JSON_MIRROR
-    
\ No newline at end of file
+
+
+@dataclass
+class TestNode(JSONSerializable):
+    """
+    Test class with a recursive type
+    """
+    __test__ = False
+    value: int
+    children: List["TestNode"]
+    parent_name: Optional[TestClass1] = None
+    coords: Tuple[int, ...] = ()
+
+
+def test_json_serializable_recursive():
+    """
+    Test decoding recursive and optional types
+    """
+    d = {
+        "value": 1,
+        "children": [{"value": 2, "children": [], "parent_name": {"test_property": "a"}}],
+        "coords": [1, 2, 3],
+    }
+    node = TestNode.from_dict(d)
+    assert node.children[0] == TestNode(2, [], TestClass1("a"))
+    assert node.parent_name is None
+    assert node.coords == (1, 2, 3)
+
+
+def test_invalidate_codecs():
+    """
+    Test that compiled decoders can be dropped and recompiled
+    """
+    assert TestClass2.from_dict(JSON_MIRROR).to_dict() == JSON_MIRROR
+    invalidate_codecs(TestClass2)
+    assert TestClass2.from_dict(JSON_MIRROR).to_dict() == JSON_MIRROR
+    invalidate_codecs()
+    assert TestClass2.from_dict(JSON_MIRROR).to_dict() == JSON_MIRROR
+
+
+def test_json_encoding():
+    """
+    Test to_json and write_json against the dict representation
+    """
+    node = TestNode.from_dict(
+        {"value": 1, "children": [{"value": 2, "children": [], "coords": [3]}]}
+    )
+    expected = json.dumps(node.to_dict())
+    assert node.to_dict()["children"][0]["coords"] == [3]
+    assert node.to_json() == expected
+    assert TestNode.from_json(node.to_json()) == node
+
+    text = io.StringIO()
+    node.write_json(text)
+    assert text.getvalue() == expected
+
+    binary = io.BytesIO()
+    node.write_json(binary)
+    assert binary.getvalue() == expected.encode("utf-8")
+
+    assert dumps({"node": node, "n": 1}) == f'{{"node": {expected}, "n": 1}}'
+
+
+def test_json_encoding_custom_to_dict():
+    """
+    Test that to_json and write_json_lines use the to_dict of subclasses overriding it
+    """
+
+    @dataclass
+    class _Custom(JSONSerializable):
+        a: int
+
+        def to_dict(self) -> Dict[str, Any]:
+            return {"a": self.a * 10}
+
+    obj = _Custom(1)
+    assert json.loads(obj.to_json()) == obj.to_dict() == {"a": 10}
+    assert json.loads(dumps([obj])) == [{"a": 10}]
+    text = io.StringIO()
+    write_json_lines([obj], text)
+    assert json.loads(text.getvalue()) == {"a": 10}
+
+
+def test_json_lines():
+    """
+    Test writing and reading objects as JSON lines
+    """
+    objs = [TestClass1(f"test {i}") for i in range(100)]
+    for fp in (io.StringIO(), io.BytesIO()):
+        assert write_json_lines(objs, fp, buffer_size=64) == len(objs)
+        fp.seek(0)
+        assert list(TestClass1.iter_from_json_lines(fp)) == objs
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_json_array(chunk_size: int):
+    """
+    Test incrementally reading a JSON array
+    """
+    objs = [TestClass1(f"test {i} ü") for i in range(50)]
+    text = " [ " + " ,\n".join(o.to_json() for o in objs) + " ]\n"
+    for fp in (io.StringIO(text), io.BytesIO(text.encode("utf-8"))):
+        assert list(TestClass1.iter_from_json_array(fp, chunk_size)) == objs
+
+    assert not list(TestClass1.iter_from_json_array(io.StringIO("[]"), chunk_size))
+    for invalid in ["", "{}", '[{"test_property": "a"}', '[{"test_property": "a"} {}]']:
+        with pytest.raises(ValueError):
+            list(TestClass1.iter_from_json_array(io.StringIO(invalid), chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4, 6, 1 << 16])
+def test_json_array_numbers(chunk_size: int):
+    """
+    Test that numbers split across chunks are not truncated
+    """
+    text = "[1.5, 22, 3e5, -4, 0.25E-2]"
+    assert list(_iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+
+@dataclass
+class TestCircle(JSONSerializable, json_tag="circle"):
+    """
+    Tagged test class
+    """
+    __test__ = False
+    size: float
+
+
+@dataclass
+class TestSquare(JSONSerializable, json_tag="square"):
+    """
+    Tagged test class with the same fields as TestCircle
+    """
+    __test__ = False
+    size: float
+
+
+@dataclass
+class TestLine(JSONSerializable, json_tag="line", json_tag_field="kind"):
+    """
+    Tagged test class storing its tag in a field
+    """
+    __test__ = False
+    kind: str = "line"
+
+
+@dataclass
+class TestDrawing(JSONSerializable):
+    """
+    Test class with tagged unions
+    """
+    __test__ = False
+    shapes: List[Union[TestCircle, TestSquare]]
+    line: Optional[TestLine] = None
+
+
+def test_tagged_union():
+    """
+    Test that union members are picked by their tag
+    """
+    drawing = TestDrawing([TestSquare(1.0), TestCircle(2.0)], TestLine())
+    d = drawing.to_dict()
+    assert d == {
+        "shapes": [{"type": "square", "size": 1.0}, {"type": "circle", "size": 2.0}],
+        "line": {"kind": "line"},
+    }
+    assert json.loads(drawing.to_json()) == d
+    assert TestDrawing.from_dict(d) == drawing
+    assert TestDrawing.from_json(drawing.to_json()) == drawing
+
+
+def test_lazy_decoding():
+    """
+    Test that lazily decoded fields are decoded on first access only
+    """
+    d = {
+        "value": 1,
+        "children": [{"value": 2, "children": [], "coords": [3]}],
+        "coords": [1, 2],
+    }
+    node = TestNode.from_dict(d, lazy=True)
+    assert "children" not in vars(node)
+    assert node.to_dict() == {**d, "parent_name": None}
+    assert node.to_json() == json.dumps(node.to_dict())
+    assert "children" not in vars(node)
+
+    child = node.children[0]
+    assert "children" in vars(node)
+    assert child.coords == (3,)
+    assert node.coords == (1, 2)
+    assert node == TestNode.from_dict(d)
+    assert node.to_dict() == TestNode.from_dict(d).to_dict()
+
+    with pytest.raises(AttributeError):
+        _ = node.missing_attribute  # type: ignore
+
+    # Raw values are dropped once decoded
+    assert "_json_pending" not in vars(node)
+    node = TestNode.from_dict(d, lazy=True)
+    assert list(vars(node)["_json_pending"]) == ["children"]
+    _ = node.children
+    assert "_json_pending" not in vars(node)
+
+
+def test_lazy_pickle():
+    """
+    Test pickling and copying lazily decoded objects
+    """
+    d = {"value": 1, "children": [{"value": 2, "children": [], "coords": [3]}], "coords": [1]}
+    node = TestNode.from_dict(d, lazy=True)
+    assert pickle.loads(pickle.dumps(node)) == TestNode.from_dict(d)
+    assert "_json_pending" not in vars(node)
+    assert copy.deepcopy(TestNode.from_dict(d, lazy=True)) == TestNode.from_dict(d)
+    point = TestPoint.slotted()(1, 2.0, "p")
+    assert copy.copy(point) == point
+    restored = pickle.loads(pickle.dumps(point))
+    assert isinstance(restored, TestPoint.slotted())
+    assert restored == point
+
+
+@dataclass
+class TestUntyped(JSONSerializable):
+    """
+    Test class with containers without type arguments
+    """
+    __test__ = False
+    xs: list
+    ys: set
+    pairs: tuple
+    attrs: dict
+
+
+def test_untyped_containers():
+    """
+    Test encoding and decoding containers without type arguments
+    """
+    obj = TestUntyped([1, "a"], {2}, (3, 4), {"k": [5]})
+    d = {"xs": [1, "a"], "ys": [2], "pairs": [3, 4], "attrs": {"k": [5]}}
+    assert obj.to_dict() == d
+    assert json.loads(obj.to_json()) == d
+    for lazy in (False, True):
+        decoded = TestUntyped.from_dict(d, lazy=lazy)
+        assert decoded.pairs == (3, 4)
+        assert decoded.to_dict() == d
+
+
+@dataclass
+class TestPoint(JSONSerializable):
+    """
+    Test class with primitive fields
+    """
+    __test__ = False
+    x: int
+    y: float
+    label: str = ""
+
+
+def test_slotted():
+    """
+    Test the __slots__ based variant of a class
+    """
+    slotted_circle = TestCircle.slotted()
+    assert TestCircle.slotted() is slotted_circle
+    circle = slotted_circle.from_dict({"type": "circle", "size": 1.0})
+    assert not hasattr(circle, "__dict__")
+    assert circle.size == 1.0
+    assert circle.to_dict() == TestCircle(1.0).to_dict()
+    assert circle.to_json() == TestCircle(1.0).to_json()
+
+
+def test_batch():
+    """
+    Test decoding records into a columnar batch
+    """
+    ds = [{"x": i, "y": i / 2, "label": str(i)} for i in range(10)] + [{"x": 10, "y": 5}]
+    batch = TestPoint.from_dicts(ds)
+    assert len(batch) == 11
+    assert batch.column("x") == array("q", range(11))
+    assert isinstance(batch.column("y"), array)
+    assert batch[3] == TestPoint(3, 1.5, "3")
+    assert batch[-1] == TestPoint(10, 5.0, "")
+    assert list(batch) == [TestPoint.from_dict(d) for d in ds]
+    assert batch.to_dicts() == [TestPoint.from_dict(d).to_dict() for d in ds]
+
+    # Values not fitting in an array are stored in a list
+    batch.extend([{"x": 1 << 70, "y": 0.0}])
+    assert batch[-1].x == 1 << 70
+    assert isinstance(batch.column("x"), list)
+
+    with pytest.raises(TypeError):
+        batch.extend([{"x": 1, "y": 0.0, "z": 1}])
+    with pytest.raises(IndexError):
+        _ = batch[100]
+    with pytest.raises(TypeError, match="indices must be integers"):
+        _ = batch[1:3]  # type: ignore
+
+
+def test_json_sources(tmp_path: Path):
+    """
+    Test decoding from bytes-like objects, paths and files
+    """
+    node = TestNode(1, [TestNode(2, [])], TestClass1("ü"))
+    data = node.to_json().encode("utf-8")
+    path = tmp_path / "node.json"
+    path.write_bytes(data)
+
+    for src in [data, bytearray(data), memoryview(data), path]:
+        assert TestNode.from_json(src) == node
+    with open(path, "rb") as fp:
+        assert TestNode.from_json(fp) == node
+    with open(path, "r", encoding="utf-8") as fp:
+        assert TestNode.from_json(fp) == node
+    assert TestNode.from_json(io.BytesIO(data)) == node
+
+
+def test_json_parser():
+    """
+    Test swapping the JSON parser
+    """
+    calls: List[Any] = []
+
+    def _loads(s: Any) -> Any:
+        calls.append(s)
+        return json.loads(s)
+
+    try:
+        set_json_parser(_loads)
+        assert TestClass1.from_json('{"test_property": "a"}') == TestClass1("a")
+        assert len(calls) == 1
+
+        pytest.importorskip("orjson")
+        set_json_parser("orjson")
+        data = memoryview(b'{"test_property": "a"}')
+        assert TestClass1.from_json(data) == TestClass1("a")
+    finally:
+        set_json_parser()
@@ -1,9 +1,20 @@
 """
 Tests for the logging module
 """
+import io
+import json
 import logging
+import threading
+from dataclasses import dataclass
 from unittest.mock import MagicMock
-from frittomisto.logging import get_logger, log_level
+import pytest
+from frittomisto.json import JSONSerializable
+from frittomisto.logging import (
+    get_logger,
+    log_level,
+    BackgroundStreamHandler,
+    SamplingFilter,
+)
 
 
 def test_get_logger() -> None:
@@ -29,3 +40,137 @@ def test_log_level() -> None:
         assert logger.level == logging.INFO
     with log_level(logging.WARNING, "test"):
         assert logger.level == logging.WARNING
+
+
+def test_background_logger() -> None:
+    """
+    Test logging from a background thread, in batches
+    """
+    stream = io.StringIO()
+    stream.write = MagicMock(wraps=stream.write)  # type: ignore
+    logger = get_logger("test_background", stream=stream, background=True)
+    handler = logger.handlers[-1]
+    assert isinstance(handler, BackgroundStreamHandler)
+    for i in range(100):
+        logger.error("message %d", i)
+    handler.flush()
+    lines = stream.getvalue().splitlines()
+    assert [line.rsplit(" ", 1)[1] for line in lines] == [str(i) for i in range(100)]
+    assert stream.write.call_count < 100  # type: ignore
+    handler.close()
+
+
+def test_background_logger_full_queue() -> None:
+    """
+    Test dropping or waiting when the queue of records is full
+    """
+    unblocked = threading.Event()
+    stream = io.StringIO()
+    write = stream.write
+
+    def _slow_write(text: str) -> int:
+        unblocked.wait()
+        return write(text)
+
+    stream.write = _slow_write  # type: ignore
+    logger = logging.getLogger("test_full_queue")
+    logger.propagate = False
+    dropped = 0
+    for block in (False, True):
+        handler = BackgroundStreamHandler(stream, queue_size=2, block=block)
+        logger.addHandler(handler)
+        unblocked.clear()
+        if block:
+            threading.Timer(0.05, unblocked.set).start()
+        for i in range(10):
+            logger.error("message %d", i)
+        unblocked.set()
+        handler.flush()
+        if block:
+            assert handler.dropped == 0
+        else:
+            assert 0 < handler.dropped <= 8
+            assert f"{handler.dropped} log records dropped" in stream.getvalue()
+        dropped += handler.dropped
+        logger.removeHandler(handler)
+        handler.close()
+    assert stream.getvalue().count("message") == 10 + 10 - dropped
+
+
+@dataclass
+class Event(JSONSerializable):
+    """
+    Test payload
+    """
+
+    kind: str
+    count: int
+
+
+def test_structured_logger() -> None:
+    """
+    Test logging records as JSON lines
+    """
+    stream = io.StringIO()
+    logger = get_logger("test_structured", stream=stream, structured=True)
+    logger.error("message %d", 1, extra={"event": Event("a", 1)})
+    logger.error(Event("b", 2))
+    logger.error("not serializable", extra={"obj": object()})
+    try:
+        raise ValueError("error")
+    except ValueError:
+        logger.exception("exception")
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert entries[0]["message"] == "message 1"
+    assert entries[0]["event"] == {"kind": "a", "count": 1}
+    assert entries[0]["name"] == "test_structured"
+    assert entries[0]["level"] == "ERROR"
+    assert entries[1]["message"] == {"kind": "b", "count": 2}
+    assert entries[2]["obj"].startswith("<object")
+    assert "ValueError: error" in entries[3]["exc_info"]
+
+
+def test_sampling_filter() -> None:
+    """
+    Test sampling records per call site
+    """
+    stream = io.StringIO()
+    logger = get_logger("test_sampling", stream=stream, structured=True)
+    sampling = SamplingFilter(every=10)
+    logger.addFilter(sampling)
+    for i in range(100):
+        logger.error("first %d", i)
+        if i < 5:
+            logger.error("second %d", i)
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [e["message"] for e in entries] == ["first 0", "second 0"] + [
+        f"first {i}" for i in range(10, 100, 10)
+    ]
+    assert [e.get("suppressed") for e in entries[2:4]] == [9, 9]
+
+    logger.removeFilter(sampling)
+    stream.seek(0)
+    stream.truncate()
+    logger.addFilter(SamplingFilter(per_second=3))
+    for i in range(10):
+        logger.error("limited %d", i)
+    assert stream.getvalue().count("limited") == 3
+
+    with pytest.raises(ValueError):
+        SamplingFilter(every=0)
+    with pytest.raises(ValueError):
+        SamplingFilter(per_second=0)
+
+
+def test_sampling_logger() -> None:
+    """
+    Test sampling with get_logger and writing the suppressed counts as text
+    """
+    stream = io.StringIO()
+    logger = get_logger("test_sampling_text", stream=stream, sample_every=10)
+    for i in range(20):
+        logger.error("message %d", i)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("message 0")
+    assert lines[1].endswith("message 10 (9 similar records suppressed)")
@@ -1,8 +1,44 @@
 """
 Test profiling utilities
 """
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
 import pytest
-from frittomisto.profiling import pp_start, pp_stop, pp_get, pp_stats
+from frittomisto.profiling import (
+    pp_start,
+    pp_stop,
+    pp_get,
+    pp_reset,
+    pp_stats,
+    pp_profile,
+    pp_section,
+    pp_share,
+    pp_flush,
+    pp_unshare,
+    pp_collect,
+    pp_trace,
+    pp_trace_chrome,
+    pp_trace_collapsed,
+    pp_tree,
+    pp_sample_start,
+    pp_sample_stop,
+    pp_sample_collapsed,
+    pp_untrack_memory,
+    pp_save,
+    pp_load,
+    pp_compare,
+    pp_count,
+    pp_get_count,
+    _Histogram,
+    _flush_at_exit,
+    __pp_tree__,
+)
 
 
 def test_profile_rounds() -> None:
@@ -57,3 +93,435 @@ def test_profile_restop() -> None:
         pp_stop("test_profile_restop")
 
     assert pp_get("test_profile_restop").rounds == 1
+
+
+def test_histogram() -> None:
+    """
+    Test percentiles of the log-bucketed histogram
+    """
+    hist = _Histogram()
+    values = [i * 1e-6 for i in range(1, 1001)]  # 1us to 1ms
+    for v in values:
+        hist.record(v)
+    for p in (1, 50, 90, 99, 100):
+        expected = values[int(p / 100 * len(values)) - 1]
+        assert abs(hist.percentile(p) - expected) / expected < 0.05
+
+    other = _Histogram()
+    other.record(1.0, count=1000)
+    hist.merge(other)
+    assert hist.percentile(40) < 1e-3
+    assert abs(hist.percentile(60) - 1.0) < 0.05
+
+
+def test_profile_percentiles() -> None:
+    """
+    Test percentiles of a perf counter
+    """
+    for _ in range(10):
+        pp_start("test_profile_percentiles")
+        pp_stop("test_profile_percentiles")
+    pp = pp_get("test_profile_percentiles")
+    assert 0 < pp.percentile(50) <= pp.percentile(99) <= pp.max_time
+    pp_stats()
+
+
+def test_profile_decorator() -> None:
+    """
+    Test the pp_profile decorator, with and without sampling
+    """
+
+    @pp_profile("test_profile_decorator")
+    def func(x: int) -> int:
+        return x + 1
+
+    @pp_profile(sample_rate=10)
+    async def async_func() -> None:
+        pass
+
+    assert func(1) == 2
+    func(2)
+    assert pp_get("test_profile_decorator").rounds == 2
+
+    for _ in range(100):
+        asyncio.run(async_func())
+    assert pp_get(async_func.__qualname__).rounds == 100
+
+    # Bound counters are replaced after a reset
+    pp_reset("test_profile_decorator")
+    func(3)
+    assert pp_get("test_profile_decorator").rounds == 1
+
+
+def test_profile_section() -> None:
+    """
+    Test the pp_section context manager, with and without sampling
+    """
+    section = pp_section("test_profile_section")
+    for _ in range(10):
+        with section:
+            with section:
+                pass
+    assert pp_get("test_profile_section").rounds == 20
+
+    sampled = pp_section("test_profile_section_sampled", sample_rate=4)
+    for _ in range(8):
+        with sampled:
+            pass
+    assert pp_get("test_profile_section_sampled").rounds == 8
+
+    with pytest.raises(ValueError):
+        pp_section("test_profile_section_invalid", sample_rate=0)
+
+
+def test_profile_tree(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test the call tree of nested perf counters
+    """
+    pp_reset()
+    with pytest.raises(RuntimeError):
+        pp_stats(tree=True)
+    pp_start("test_tree_not_enabled")
+    pp_stop("test_tree_not_enabled")
+    assert not __pp_tree__
+
+    pp_tree()
+    pp_start("root")
+    for _ in range(3):
+        with pp_section("child"):
+            pp_start("leaf")
+            time.sleep(0.001)
+            pp_stop("leaf")
+    pp_stop("root")
+
+    assert pp_get("leaf").rounds == 3
+    root, child, leaf = (
+        __pp_tree__[p] for p in [("root",), ("root", "child"), ("root", "child", "leaf")]
+    )
+    assert root.rounds == 1 and child.rounds == 3 and leaf.rounds == 3
+    assert root.tot_time >= child.tot_time >= leaf.tot_time
+    assert child.self_time <= child.tot_time - leaf.tot_time + 1e-9
+    assert leaf.self_time == pytest.approx(leaf.tot_time)
+
+    pp_stats(tree=True)
+    pp_tree(False)
+    out = capsys.readouterr().out
+    assert "\n" + str(os.getpid()) + " | root" in out
+    assert "    leaf" in out
+
+
+def test_profile_section_unbalanced() -> None:
+    """
+    Test a section exiting while a counter started in it is still running
+    """
+    pp_reset()
+    pp_tree()
+    with pp_section("test_unbalanced_section"):
+        pp_start("test_unbalanced_inner")
+    pp_stop("test_unbalanced_inner")
+    pp_start("test_unbalanced_next")
+    pp_stop("test_unbalanced_next")
+    pp_tree(False)
+
+    assert pp_get("test_unbalanced_section").rounds == 1
+    assert ("test_unbalanced_section", "test_unbalanced_inner") in __pp_tree__
+    assert ("test_unbalanced_next",) in __pp_tree__
+
+
+def test_profile_concurrent() -> None:
+    """
+    Test that threads and asyncio tasks can time the same counter concurrently
+    """
+
+    def _thread_work() -> None:
+        for _ in range(100):
+            pp_start("test_profile_concurrent_thread")
+            time.sleep(0)
+            pp_stop("test_profile_concurrent_thread")
+
+    threads = [threading.Thread(target=_thread_work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pp_get("test_profile_concurrent_thread").rounds == 400
+
+    async def _task_work() -> None:
+        pp_start("test_profile_concurrent_task")
+        await asyncio.sleep(0.01)
+        pp_stop("test_profile_concurrent_task")
+
+    async def _main() -> None:
+        pp_start("test_profile_concurrent_main")
+        await asyncio.gather(*(_task_work() for _ in range(10)))
+        pp_stop("test_profile_concurrent_main")
+
+    pp_tree()
+    asyncio.run(_main())
+    pp_tree(False)
+    assert pp_get("test_profile_concurrent_task").rounds == 10
+    path = ("test_profile_concurrent_main", "test_profile_concurrent_task")
+    assert __pp_tree__[path].rounds == 10
+
+
+def test_profile_inherited() -> None:
+    """
+    Test that tasks can start and stop the counters running in their parent task
+    """
+
+    async def _task_work() -> None:
+        pp_start("test_inherited")
+        await asyncio.sleep(0.01)
+        pp_stop("test_inherited")
+        with pytest.raises(RuntimeError):
+            pp_stop("test_inherited_other")
+
+    async def _main() -> None:
+        pp_start("test_inherited")
+        pp_start("test_inherited_other")
+        await asyncio.gather(*(_task_work() for _ in range(2)))
+        pp_stop("test_inherited_other")
+        pp_stop("test_inherited")
+
+    pp_tree()
+    asyncio.run(_main())
+    pp_tree(False)
+    assert pp_get("test_inherited").rounds == 3
+    assert pp_get("test_inherited_other").rounds == 1
+    path = ("test_inherited", "test_inherited_other", "test_inherited")
+    assert __pp_tree__[path].rounds == 2
+
+
+def _shared_child_work() -> None:
+    for _ in range(5):
+        pp_start("test_profile_shared")
+        pp_stop("test_profile_shared")
+    pp_flush()
+
+
+def test_profile_shared(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test aggregating perf counters across processes with shared memory
+    """
+    pp_share(f"test_{os.getpid()}", flush_interval=None, slots=8, slot_size=4096)
+    try:
+        for _ in range(3):
+            pp_start("test_profile_shared")
+            pp_stop("test_profile_shared")
+
+        ctx = multiprocessing.get_context("fork")
+        children = [ctx.Process(target=_shared_child_work) for _ in range(2)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+            assert child.exitcode == 0
+
+        counters = pp_collect()
+        assert counters["test_profile_shared"].rounds == 3 + 2 * 5
+        assert counters["test_profile_shared"].max_time >= pp_get("test_profile_shared").max_time
+        assert pp_collect(f"test_{os.getpid()}")["test_profile_shared"].rounds == 13
+
+        pp_stats(aggregate=True)
+        assert "\n*   | test_profile_shared " in capsys.readouterr().out
+    finally:
+        pp_unshare(unlink=True)
+
+
+def test_profile_shared_too_large() -> None:
+    """
+    Test that snapshots too large for their slot are reported
+    """
+    pp_share(f"test_large_{os.getpid()}", flush_interval=0.01, slots=1, slot_size=256)
+    try:
+        for i in range(10):
+            pp_start(f"test_large_{i}")
+            pp_stop(f"test_large_{i}")
+        with pytest.raises(ValueError):
+            pp_flush()
+        with pytest.warns(RuntimeWarning, match="increase slot_size") as record:
+            time.sleep(0.1)
+            _flush_at_exit()
+        assert len(record) == 1
+    finally:
+        pp_unshare(unlink=True)
+
+
+def test_profile_trace() -> None:
+    """
+    Test exporting traced measures
+    """
+    pp_trace(4)
+    try:
+        for _ in range(3):
+            with pp_section("test_profile_trace_outer"):
+                with pp_section("test_profile_trace_inner"):
+                    time.sleep(0.001)
+
+        chrome = io.StringIO()
+        pp_trace_chrome(chrome)
+        events = json.loads(chrome.getvalue())["traceEvents"]
+        # Only the last 4 measures are kept
+        assert len(events) == 4
+        assert [e["ts"] for e in events] == sorted(e["ts"] for e in events)
+        inner = [e for e in events if e["name"] == "test_profile_trace_inner"]
+        assert len(inner) == 2
+        assert inner[0]["args"]["path"] == "test_profile_trace_outer;test_profile_trace_inner"
+        assert inner[0]["dur"] >= 1000
+        assert all(e["ph"] == "X" and e["pid"] == os.getpid() for e in events)
+
+        collapsed = io.StringIO()
+        pp_trace_collapsed(collapsed)
+        lines = collapsed.getvalue().splitlines()
+        assert [line.split(" ")[0] for line in lines] == [
+            "test_profile_trace_outer",
+            "test_profile_trace_outer;test_profile_trace_inner",
+        ]
+        assert int(lines[1].split(" ")[1]) >= 2000
+    finally:
+        pp_trace(None)
+    with pytest.raises(RuntimeError):
+        pp_trace_chrome(io.StringIO())
+
+
+def _sampled_busy_loop(seconds: float) -> None:
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+def test_profile_sampling(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test the statistical profiler
+    """
+    pp_sample_start(interval=0.001)
+    try:
+        with pp_section("test_profile_sampling"):
+            _sampled_busy_loop(0.2)
+    finally:
+        pp_sample_stop()
+
+    collapsed = io.StringIO()
+    pp_sample_collapsed(collapsed)
+    stacks = [line.rsplit(" ", 1) for line in collapsed.getvalue().splitlines()]
+    busy = [
+        int(n)
+        for stack, n in stacks
+        if stack.startswith("test_profile_sampling;") and "_sampled_busy_loop" in stack
+    ]
+    assert sum(busy) >= 10
+
+    pp_stats()
+    out = capsys.readouterr().out
+    assert "_sampled_busy_loop" in out
+    # Drop the samples
+    pp_sample_start()
+    pp_sample_stop()
+
+
+def test_profile_memory(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test measuring the memory allocated by perf counters
+    """
+    kept = []
+
+    @pp_profile("test_profile_memory_inner", memory=True)
+    def _allocate() -> None:
+        temporary = bytearray(1_000_000)
+        kept.append(bytearray(100_000))
+        del temporary
+
+    try:
+        with pp_section("test_profile_memory_outer", memory=True):
+            for _ in range(3):
+                _allocate()
+    finally:
+        pp_untrack_memory()
+
+    inner = pp_get("test_profile_memory_inner")
+    assert inner.mem_rounds == 3
+    assert 100_000 <= inner.mem_net // inner.mem_rounds < 200_000
+    assert 1_100_000 <= inner.mem_peak < 1_300_000
+    outer = pp_get("test_profile_memory_outer")
+    assert outer.mem_rounds == 1
+    assert 300_000 <= outer.mem_net < 400_000
+    # The peak of the outer counter includes the peaks of the nested ones
+    assert 1_300_000 <= outer.mem_peak < 1_500_000
+
+    pp_stats()
+    out = capsys.readouterr().out
+    assert "mem/round" in out
+    line = next(line for line in out.splitlines() if "test_profile_memory_inner" in line)
+    assert line.split(" | ")[-1].strip() == str(inner.mem_peak)
+
+
+def test_profile_baseline(tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test saving perf counters and comparing them with a baseline
+    """
+
+    @pp_profile("baseline_fast")
+    def _fast() -> None:
+        time.sleep(0.001)
+
+    @pp_profile("baseline_slow")
+    def _slow(seconds: float) -> None:
+        time.sleep(seconds)
+
+    @pp_profile("baseline_removed")
+    def _removed() -> None:
+        pass
+
+    for _ in range(10):
+        _fast()
+        _slow(0.001)
+    _removed()
+    baseline = str(tmp_path / "baseline.json")
+    pp_save(baseline)
+
+    saved = pp_load(baseline)
+    fast = pp_get("baseline_fast")
+    assert saved["baseline_fast"].rounds == fast.rounds
+    assert saved["baseline_fast"].percentile(99) == fast.percentile(99)
+    assert saved["baseline_fast"].variance() == pytest.approx(fast.variance())
+    with open(baseline, "r", encoding="utf-8") as f:
+        assert json.load(f)["environment"]["python"]
+
+    for name in ("fast", "slow", "removed"):
+        pp_reset(f"baseline_{name}")
+
+    @pp_profile("baseline_added")
+    def _added() -> None:
+        pass
+
+    for _ in range(10):
+        _fast()
+        _slow(0.005)
+    _added()
+
+    slowdowns = pp_compare(baseline)
+    assert list(slowdowns) == ["baseline_slow"]
+    assert slowdowns["baseline_slow"] > 2
+    out = capsys.readouterr().out
+    statuses = {
+        line.split(" | ")[0].strip(): line.split(" | ")[-1].strip()
+        for line in out.splitlines()
+        if line.startswith("baseline_")
+    }
+    assert statuses["baseline_fast"] == "ok"
+    assert statuses["baseline_slow"] == "SLOWER"
+    assert statuses["baseline_removed"] == "missing"
+    assert statuses["baseline_added"] == "new"
+
+
+def test_profile_count(capsys: pytest.CaptureFixture[str]) -> None:
+    """
+    Test event counters
+    """
+    pp_count("test_count")
+    pp_count("test_count", 2)
+    assert pp_get_count("test_count") == 3
+    pp_stats()
+    assert " | test_count | 3" in capsys.readouterr().out
+    pp_reset("test_count")
+    assert pp_get_count("test_count") == 0